@@ -0,0 +1,165 @@
+"""
+Scaling benchmark for the VIS bonus pipeline.
+
+Generates synthetic exports of each size and times the parse, normalize,
+categorize, bonus, schema, aggregate and write stages separately, reporting
+throughput and peak memory per stage. With lxml installed, parse_std times
+the standard library HTML parser on the same file.
+
+    python benchmarks/bench_pipeline.py --sizes 1000,10000,100000
+    python benchmarks/bench_pipeline.py --json today.json --compare last_week.json
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import html_format as hf  # noqa: E402
+from generate_vis_export import generate_export  # noqa: E402
+from vis_cache import parse_tables  # noqa: E402
+from vis_metrics import quiet_logs  # noqa: E402
+from vis_parser import default_html_parser  # noqa: E402
+from vis_schema import compact_dtypes  # noqa: E402
+from vis_writers import open_output_writer  # noqa: E402
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+OIL_PRICE = 30.0
+
+
+def _measure(func, with_memory):
+    """Run func() and return (result, seconds, peak traced bytes or None)"""
+    started = time.perf_counter()
+    result = func()
+    seconds = time.perf_counter() - started
+    peak = None
+    if with_memory:
+        tracemalloc.start()
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result, seconds, peak
+
+
+def bench_size(rows, work_dir, with_memory=True, output_format='xlsx'):
+    """Time every stage on a synthetic export of `rows` rows"""
+    input_file = os.path.join(work_dir, f"vis_{rows}.xls")
+    if not os.path.exists(input_file):
+        generate_export(input_file, rows)
+    results = []
+
+    def record(stage, func):
+        result, seconds, peak = _measure(func, with_memory)
+        results.append({'rows': rows, 'stage': stage, 'seconds': seconds,
+                        'rows_per_second': rows / seconds if seconds else None,
+                        'peak_bytes': peak})
+        return result
+
+    with quiet_logs():
+        tables, job_counts = record('parse', lambda: parse_tables(input_file))
+        if default_html_parser() != 'html.parser':
+            # The standard library parser on the same file, for comparison
+            record('parse_std', lambda: parse_tables(input_file, html_parser='html.parser'))
+        driver_tables = hf.build_driver_tables(tables)
+        rate_table = hf.load_rate_table()
+
+        def normalize():
+            return [(hf.to_number(df['กิโลเมตร']),
+                     hf.normalize_driver_names(df['ชื่อ-นามสกุล']))
+                    for _, df in driver_tables]
+        normalized = record('normalize', normalize)
+
+        record('categorize', lambda: [hf.categorize_distance(km) for km, _ in normalized])
+
+        km_totals = hf.merge_km_totals(
+            hf.table_driver_km_totals(df) for _, df in driver_tables)
+        processed = [hf.process_driver_data(df, job_counts, OIL_PRICE, rate_table,
+                                            driver_km_totals=km_totals, km_bonus_paid=set())
+                     for _, df in driver_tables]
+
+        def bonus():
+            paid = set()
+            return [(hf.calculate_bonus_vectorized(df, rate_table),
+                     hf.km_bonus_column(df['ชื่อ-นามสกุล'], df['รวมกิโลเมตร'], paid))
+                    for df in processed]
+        record('bonus', bonus)
+
+        record('schema', lambda: [compact_dtypes(df.copy()) for df in processed])
+        processed = [compact_dtypes(df)[0] for df in processed]
+
+        def aggregate():
+            summaries = None
+            for df in processed:
+                summaries = hf.merge_driver_summaries(summaries, hf.summarize_drivers(df))
+            return hf.driver_summary_frame(summaries)
+        summary_df = record('aggregate', aggregate)
+
+        output_path = os.path.join(work_dir, f"vis_{rows}_processed.{output_format}")
+        columns = hf.processed_columns(driver_tables, OIL_PRICE)
+
+        def write():
+            with open_output_writer(output_path, columns, output_format) as writer:
+                for df in processed:
+                    writer.write_table(df)
+                writer.write_summary(summary_df)
+        record('write', write)
+
+        record('end_to_end', lambda: hf.process_file(
+            input_file, OIL_PRICE, output_path, output_format=output_format))
+    return results
+
+
+def print_report(results, baseline=None):
+    baseline_seconds = {(r['rows'], r['stage']): r['seconds'] for r in baseline or []}
+    print(f"{'rows':>9} {'stage':<11} {'seconds':>9} {'rows/s':>12} {'peak MB':>9}"
+          + ("  vs baseline" if baseline else ""))
+    for r in results:
+        peak = f"{r['peak_bytes'] / 1e6:9.1f}" if r['peak_bytes'] is not None else f"{'-':>9}"
+        line = (f"{r['rows']:>9} {r['stage']:<11} {r['seconds']:>9.3f} "
+                f"{r['rows_per_second'] or 0:>12,.0f} {peak}")
+        previous = baseline_seconds.get((r['rows'], r['stage']))
+        if previous:
+            ratio = r['seconds'] / previous
+            line += f"  {ratio:5.2f}x" + ("  SLOWER" if ratio > 1.2 else "")
+        print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the VIS bonus pipeline")
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                        help="comma separated row counts, e.g. 1000,10000,1000000")
+    parser.add_argument('--format', default='xlsx', choices=['xlsx', 'csv', 'parquet'],
+                        help="output format for the write stage")
+    parser.add_argument('--work-dir', help="keep generated exports here (default: temp dir)")
+    parser.add_argument('--no-memory', action='store_true',
+                        help="skip the tracemalloc pass (faster, no peak memory)")
+    parser.add_argument('--json', help="write the results to this JSON file")
+    parser.add_argument('--compare', help="JSON results of an earlier run to compare against")
+    args = parser.parse_args(argv)
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        work_dir = args.work_dir or tmp_dir
+        os.makedirs(work_dir, exist_ok=True)
+        for rows in sizes:
+            results.extend(bench_size(rows, work_dir, not args.no_memory, args.format))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as file:
+            baseline = json.load(file)['results']
+    print_report(results, baseline)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            json.dump({'sizes': sizes, 'format': args.format, 'results': results},
+                      file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
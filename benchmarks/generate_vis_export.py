@@ -0,0 +1,134 @@
+"""
+Generate synthetic VIS-style HTML exports for benchmarks.
+
+The output mimics the real exports: several <table>s, each with a title row
+and a header row, 'รวม' summary rows, Thai driver names with irregular
+spacing, job numbers shared by two drivers, zero-km continuation rows and
+special ต้นทาง sources (รถฝึก, รถซ่อม, ...).
+
+    python benchmarks/generate_vis_export.py 100000 -o vis_100k.xls
+"""
+import argparse
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from html_format import driver_km_bonuses, load_fleet_registry, zero_calculation_sources  # noqa: E402
+
+HEADERS = ['ลำดับ', 'วันที่', 'เลข Job', 'เบอร์รถ', 'ชื่อ พขร.', 'ต้นทาง', 'ปลายทาง',
+           'กิโลเมตร', 'น้ำม                      มัน(ลิตร)', 'เรท']
+
+FIRST_NAMES = ['สมชาย', 'สมศักดิ์', 'ประยุทธ', 'วิชัย', 'สุรชัย', 'อนันต์', 'ชัยวัฒน์', 'ธนากร',
+               'กิตติ', 'พงษ์ศักดิ์', 'สุเมธ', 'บุญมา', 'ทองดี', 'มานพ', 'ศักดิ์ชัย', 'เอกชัย']
+LAST_NAMES = ['ใจดี', 'มีสุข', 'ทองคำ', 'ศรีสุข', 'บุญเรือง', 'แก้วมณี', 'สายทอง', 'พรหมมา',
+              'วงศ์ไทย', 'จันทร์เพ็ญ', 'รุ่งเรือง', 'เพชรดี', 'สุขสวัสดิ์', 'คงทน']
+PLACES = ['AAT', 'BKK', 'LCB', 'ชลบุรี', 'ระยอง', 'อยุธยา', 'สระบุรี', 'นครราชสีมา', 'ขอนแก่น']
+
+# Typical (old, new) fuel rates in km/liter per car type
+CAR_TYPE_RATES = {'full_23m': (3.8, 4.4), 'full_25m': (3.8, 4.3), 'flatbed': (4.5, 6.0),
+                  'type_s': (5.5, 6.5), 'type_sb': (6.0, 7.5), 'unknown': (4.0, 5.0)}
+
+
+def _driver_names(count, rng):
+    """Driver names with the irregular spacing seen in VIS output"""
+    names = list(driver_km_bonuses)
+    while len(names) < count:
+        names.append(f"นาย {rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}")
+    names = names[:count]
+
+    def messy(name):
+        separator = rng.choice([' ', ' ', ' ', '  ', '&nbsp;', ' &nbsp; '])
+        return separator.join(name.split(' ')) + rng.choice(['', '', ' '])
+
+    return [messy(name) for name in names]
+
+
+def generate_export(output_path, rows, rows_per_table=2000, drivers=300, seed=0):
+    """Write a synthetic export with about `rows` data rows to output_path"""
+    rng = random.Random(seed)
+    names = _driver_names(drivers, rng)
+    fleet = load_fleet_registry().car_types
+    cars = list(fleet) + ['X1', 'X2']
+    job = 100000
+    shared_jobs = []
+
+    with open(output_path, 'w', encoding='utf-8') as file:
+        file.write('<html><head><meta http-equiv="Content-Type" '
+                   'content="text/html; charset=utf-8"></head><body>\n')
+        written = 0
+        table_index = 0
+        while written < rows:
+            table_rows = min(rows_per_table, rows - written)
+            file.write('<table border="1">\n')
+            file.write(f'<tr><th colspan="{len(HEADERS)}">รายงานการวิ่งรถ ชุดที่ {table_index + 1}</th></tr>\n')
+            file.write('<tr>' + ''.join(f'<th>{h}</th>' for h in HEADERS) + '</tr>\n')
+
+            total_km = 0.0
+            previous_zero = False
+            lines = []
+            for i in range(table_rows):
+                # ~20% of jobs are driven by two drivers, possibly in different tables
+                if shared_jobs and rng.random() < 0.2:
+                    job_number = shared_jobs.pop(rng.randrange(len(shared_jobs)))
+                else:
+                    job += 1
+                    job_number = f"JOB{job}"
+                    if rng.random() < 0.2:
+                        shared_jobs.append(job_number)
+
+                car = rng.choice(cars)
+                car_type = fleet.get(car, 'unknown')
+                source = (rng.choice(zero_calculation_sources) if rng.random() < 0.03
+                          else rng.choice(PLACES))
+
+                # Zero-km rows start a continuous trip with the next row
+                if not previous_zero and rng.random() < 0.1:
+                    km = 0.0
+                else:
+                    km = round(rng.choice([rng.uniform(30, 350), rng.uniform(350, 800),
+                                           rng.uniform(800, 1500)]), 1)
+                previous_zero = km == 0
+                total_km += km
+
+                old_rate, new_rate = CAR_TYPE_RATES[car_type]
+                if km == 0 or rng.random() < 0.02:
+                    rate, liters = '', ''
+                else:
+                    actual = round(rng.uniform(old_rate * 0.85, new_rate * 1.15), 2)
+                    rate, liters = f"{actual:.2f}", f"{km / actual:,.2f}"
+
+                cells = [str(i + 1), f"{rng.randint(1, 28):02d}/04/2025", job_number, car,
+                         rng.choice(names), source, rng.choice(PLACES), f"{km:,.1f}", liters, rate]
+                lines.append('<tr>' + ''.join(f'<td>{c}</td>' for c in cells) + '</tr>\n')
+                if len(lines) >= 1000:
+                    file.write(''.join(lines))
+                    lines = []
+            file.write(''.join(lines))
+
+            file.write(f'<tr><td colspan="7">รวม</td><td>{total_km:,.1f}</td><td></td><td></td></tr>\n')
+            file.write('</table>\n<br>\n')
+            written += table_rows
+            table_index += 1
+        file.write('</body></html>\n')
+    return output_path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic VIS HTML export")
+    parser.add_argument('rows', type=int, help="number of data rows (1k to 1M)")
+    parser.add_argument('-o', '--output', default=None,
+                        help="output file (default: vis_synthetic_<rows>.xls)")
+    parser.add_argument('--rows-per-table', type=int, default=2000)
+    parser.add_argument('--drivers', type=int, default=300)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    output_path = args.output or f"vis_synthetic_{args.rows}.xls"
+    generate_export(output_path, args.rows, args.rows_per_table, args.drivers, args.seed)
+    print(f"Wrote {args.rows} rows to {output_path} ({os.path.getsize(output_path) / 1e6:.1f} MB)")
+
+
+if __name__ == "__main__":
+    main()
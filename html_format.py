@@ -1,17 +1,40 @@
+import argparse
+import csv
+import functools
+import glob
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import sys
+import time
+from collections import namedtuple
+
 import pandas as pd
 import numpy as np
-from bs4 import BeautifulSoup
-
-# Define car type arrays
-full_23m = ['91', '94', '97', '98', '99', '100', '101', '102', '117', '118', '120', '121', '122', '123',
-            '124', '125', '126', '127', '128', '129', '131', '132', '133', '134', '135', '136', '137',
-            '138', '139', '140', '141', '142', '143', '144', '145', '146', '147', '148', '149', '150', 'VL-02']
-full_25m = ['151', '152', '153', '154', '155', '156',
-            '157', '158', '159', '160', '161', '162', '163', '164']
-flatbed = ['F01', 'F02', 'F03', 'F04', 'F05',
-           'F06', 'F07', 'F08', 'F09', 'F10', 'F11', 'F12']
-type_s = ['S6', 'S7']
-type_sb = ['SB2']
+
+from vis_cache import (DEFAULT_CACHE_DIR, DEFAULT_CACHE_MAX_BYTES, invalidate,
+                       parse_html, read_tables)
+from vis_cube import (BREAKDOWNS, breakdown_sheets, build_cube, merge_cubes,
+                      parse_breakdowns, save_cube)
+from vis_metrics import (RunMetrics, collect_metrics, configure_logging, logger,
+                         quiet_logs, record_stage, row_logger, stage,
+                         write_run_report)
+from vis_parser import canonical_header, iter_vis_tables, merge_job_counts
+from vis_pipeline import PIPELINE_DEPTH, pipelined
+from vis_schema import compact_dtypes, concat_compact, parse_vis_dates
+from vis_store import DEFAULT_STORE_PATH, TripStore
+from vis_sums import exact_sums, to_float
+from vis_writers import OUTPUT_FORMATS, open_output_writer, write_frame
+
+# Car types in the order of the rate table columns, plus unknown cars
+CAR_TYPES = ['full_23m', 'full_25m', 'flatbed', 'type_s', 'type_sb', 'unknown']
+
+# Fleet registry file: car number -> car type, optionally date-effective
+FLEET_PATH = os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), 'data', 'fleet.csv')
 
 # Driver KM bonus data from the provided table
 driver_km_bonuses = {
@@ -25,55 +48,217 @@ driver_km_bonuses = {
     'นาย สรายุทธ กลีบรัง': 1500,
 }
 
+# Rows per chunk when oversized tables are processed chunk by chunk
+CHUNK_ROWS = 50000
+
 # Define the list of values in 'ต้นทาง' that should cause zero calculations
 zero_calculation_sources = [
     'รถฝึก', 'รถเข้าศูนย์', 'รถซ่อม', 'รถเสีย', 'AAT TOY', 'FTM TOY']
 
 
+# Runs of whitespace in VIS text: spaces, tabs, newlines, non-breaking and
+# other Unicode spaces - the characters str.split() splits on, spelled out
+# because pyarrow-backed string columns match \s against ASCII only
+_WHITESPACE = ('[\t-\r\x1c-\x20\x85\xa0\u1680\u2000-\u200a'
+               '\u2028\u2029\u202f\u205f\u3000]+')
+
+# Zero-width characters Thai text uses as invisible word breaks, and BOMs
+_ZERO_WIDTH = '[\u200b\u200c\u200d\u2060\ufeff]'
+
+_WHITESPACE_RE = re.compile(_WHITESPACE)
+_ZERO_WIDTH_RE = re.compile(_ZERO_WIDTH)
+
+
 def normalize_driver_name(name):
     """
     Normalize driver names by ensuring only one space between words
     Example: "นาย  วิชิต  เรืองชาญ" becomes "นาย วิชิต เรืองชาญ"
+    Non-breaking spaces count as spaces and zero-width characters are dropped.
     """
     if not name or not isinstance(name, str):
         return name
 
-    # Split by spaces and filter out empty strings
-    parts = [part for part in name.split() if part]
-    # Rejoin with single spaces
-    return " ".join(parts)
+    return _WHITESPACE_RE.sub(' ', _ZERO_WIDTH_RE.sub('', name)).strip()
+
+
+def map_unique(values, func):
+    """
+    Apply func to the distinct values of a column only and spread the results
+    back over the rows (missing values stay missing). func takes and returns
+    a Series of the distinct values. Driver names and sources repeat
+    thousands of times, so this is much less work than per-row processing.
+    """
+    codes, uniques = pd.factorize(values, sort=False)
+    results = func(pd.Series(np.asarray(uniques, dtype=object)))
+    return pd.Series(pd.api.extensions.take(results.to_numpy(), codes, allow_fill=True),
+                     index=values.index, name=values.name)
+
 
+def _normalize_text(values):
+    """normalize_driver_name over a Series of str values with vectorized string ops"""
+    if not all(isinstance(value, str) for value in values):
+        return values.map(normalize_driver_name)
+    return (values.str.replace(_ZERO_WIDTH, '', regex=True)
+            .str.replace(_WHITESPACE, ' ', regex=True)
+            .str.strip())
 
-# Normalize driver names in the driver_km_bonuses dictionary
-normalized_driver_km_bonuses = {}
-for driver, bonus in driver_km_bonuses.items():
-    normalized_driver_km_bonuses[normalize_driver_name(driver)] = bonus
-driver_km_bonuses = normalized_driver_km_bonuses
+
+def normalize_driver_names(names):
+    """normalize_driver_name for a whole column, each distinct name normalized once"""
+    normalized = map_unique(names, _normalize_text)
+    if pd.api.types.is_string_dtype(names.dtype) and not isinstance(
+            names.dtype, pd.CategoricalDtype):
+        return normalized.astype(names.dtype)
+    return normalized
+
+
+@functools.lru_cache(maxsize=None)
+def special_source_pattern(sources):
+    """
+    Compiled case-insensitive matcher for any of the given ต้นทาง terms
+    (a tuple, e.g. tuple(zero_calculation_sources)), built once per list
+    """
+    return re.compile('|'.join(map(re.escape, sources)), re.IGNORECASE)
+
+
+def special_source_mask(sources):
+    """Rows whose ต้นทาง contains one of zero_calculation_sources"""
+    pattern = special_source_pattern(tuple(zero_calculation_sources))
+    return map_unique(sources, lambda values: values.str.contains(pattern, na=False)
+                      ).fillna(False).astype(bool)
+
+
+@functools.lru_cache(maxsize=None)
+def km_bonus_rates():
+    """driver_km_bonuses keyed by normalized driver name, built on first use"""
+    return {normalize_driver_name(driver): bonus
+            for driver, bonus in driver_km_bonuses.items()}
 
 
 def get_car_type(car_number):
-    if car_number in full_23m:
-        return "full_23m"
-    elif car_number in full_25m:
-        return "full_25m"
-    elif car_number in flatbed:
-        return "flatbed"
-    elif car_number in type_s:
-        return "type_s"
-    elif car_number in type_sb:
-        return "type_sb"
-    else:
-        return "unknown"
+    return load_fleet_registry().car_types.get(car_number, "unknown")
 
 
 def get_km_bonus(driver_name, total_km):
     """Get the kilometer bonus for a driver if they exceed 5000km"""
-    if driver_name in driver_km_bonuses and total_km > 5000:
-        print(driver_name, total_km)
-        return driver_km_bonuses[driver_name]
+    rates = km_bonus_rates()
+    if driver_name in rates and total_km > 5000:
+        row_logger.debug("%s %s", driver_name, total_km)
+        return rates[driver_name]
     return 0
 
 
+def to_number(series):
+    """Convert a column of VIS numbers ('1,234.5', '') to floats, blanks become 0"""
+    return pd.to_numeric(series.astype(str).str.replace(
+        ',', '').replace('', '0'), errors='coerce').fillna(0).astype(np.float64)
+
+
+def table_driver_km_totals(df):
+    """
+    Total kilometers per normalized driver name for one raw or processed
+    table (or a chunk of one), in order of first appearance. Totals are
+    exact (Fractions, see vis_sums) so they add up the same however the
+    rows were split.
+    """
+    if 'ชื่อ-นามสกุล' in df.columns:
+        names = df['ชื่อ-นามสกุล']
+    elif 'ชื่อ พขร.' in df.columns:
+        names = df['ชื่อ พขร.']
+    else:
+        return pd.Series(dtype=object)
+    codes, uniques = pd.factorize(normalize_driver_names(names), sort=False)
+    kilometers = to_number(df['กิโลเมตร']).to_numpy(dtype=float)
+    return pd.Series(exact_sums(kilometers, codes, len(uniques)),
+                     index=np.asarray(uniques, dtype=object), dtype=object)
+
+
+def merge_km_totals(km_totals):
+    """Add up exact per-driver km totals from several tables, chunks or files"""
+    km_totals = [totals for totals in km_totals if not totals.empty]
+    if not km_totals:
+        return pd.Series(dtype=object)
+    combined = pd.concat(km_totals)
+    codes, uniques = pd.factorize(combined.index, sort=False)
+    totals = [0] * len(uniques)
+    for code, total in zip(codes.tolist(), combined.tolist()):
+        totals[code] += total
+    return pd.Series(totals, index=np.asarray(uniques, dtype=object), dtype=object)
+
+
+def job_crews(df):
+    """
+    Distinct (job, driver) pairs of one raw or processed table (or a chunk
+    of one), with normalized driver names, for the job-crew registry
+    """
+    if 'ชื่อ-นามสกุล' in df.columns:
+        names = df['ชื่อ-นามสกุล']
+    elif 'ชื่อ พขร.' in df.columns:
+        names = df['ชื่อ พขร.']
+    else:
+        return pd.DataFrame(columns=['job', 'driver'])
+    crews = pd.DataFrame({'job': df['เลข Job'].astype(object),
+                          'driver': normalize_driver_names(names).astype(object)})
+    crews = crews[crews['job'].notna() & (crews['job'] != '')
+                  & crews['driver'].notna() & (crews['driver'] != '')]
+    return crews.drop_duplicates(ignore_index=True)
+
+
+def merge_job_crews(crews):
+    """Combine job_crews() of several tables, chunks or files"""
+    crews = [table_crews for table_crews in crews if not table_crews.empty]
+    if not crews:
+        return pd.DataFrame(columns=['job', 'driver'])
+    return pd.concat(crews).drop_duplicates(ignore_index=True)
+
+
+def job_count_lookup(job_counts):
+    """
+    job_counts (job number -> 1 or 2) as a Series. Series.map hashes a dict
+    into a new Series on every call, so with tens of thousands of jobs the
+    lookup is built once per export instead of once per table.
+    """
+    return job_counts if isinstance(job_counts, pd.Series) else pd.Series(job_counts)
+
+
+def registry_job_counts(job_counts, crews, registry_path):
+    """
+    Add an export's crews to the job-crew registry at registry_path (see
+    vis_store) and return its job counts raised to the registered crew
+    sizes, capped at 2 like the per-file counts. A job whose other driver
+    was in an earlier export then counts as a two-driver job.
+    """
+    started = time.perf_counter()
+    with TripStore(registry_path) as registry:
+        registry.add_crews(crews)
+        crew_sizes = registry.crew_sizes(job_counts)
+    counts = pd.Series(job_counts, dtype='int64')
+    counts = np.maximum(counts, crew_sizes.reindex(counts.index, fill_value=0).clip(upper=2))
+    record_stage('job count', time.perf_counter() - started, len(counts))
+    logger.info("%d jobs have drivers in other exports",
+                int((counts > pd.Series(job_counts, dtype='int64')).sum()))
+    return dict(zip(counts.index, counts.tolist()))
+
+
+def km_bonus_column(driver_names, total_km, km_bonus_paid=None):
+    """
+    KM bonus for every row: drivers in driver_km_bonuses with more than
+    5000 km get their bonus on their first row only, all other rows get 0.
+    Drivers in km_bonus_paid already had their first row in an earlier table.
+    """
+    bonus = driver_names.map(km_bonus_rates()).where(total_km > 5000)
+    first_row = driver_names.notna() & ~driver_names.duplicated()
+    if km_bonus_paid is not None:
+        first_row &= ~driver_names.isin(km_bonus_paid)
+        km_bonus_paid.update(driver_names[first_row])
+    bonus = bonus.where(first_row).fillna(0).astype('int64')
+
+    if row_logger.isEnabledFor(logging.DEBUG):
+        for name, km in zip(driver_names[bonus > 0], total_km[bonus > 0]):
+            row_logger.debug("%s %s", name, km)
+    return bonus
+
+
 def calculate_bonus(row, rate_table):
     # Get vehicle type and distance category
     car_type = row["ประเภทรถ"]
@@ -137,150 +322,399 @@ def calculate_bonus(row, rate_table):
     else:  # Worse than old rate
         extra_used = actual_used - expected_new
         bonus = -extra_used  # Driver pays back 100% below ceiling
-        print(distance_cat, actual_used, actual_rate, expected_new,
-              new_rate, extra_used, bonus)
+        row_logger.debug("%s %s %s %s %s %s %s", distance_cat, actual_used,
+                         actual_rate, expected_new, new_rate, extra_used, bonus)
+
+    return bonus
+
 
+def categorize_distance(kilometers, prev_km=np.nan, next_km=0.0):
+    """
+    Categorize each trip by distance, following continuous trips:
+    a 0 km row takes its category from the next row, and the row after a
+    0 km row gets the "(ต่อเนื่อง)" variant when it is under 350 km.
+    prev_km/next_km are the kilometers just outside the given rows
+    (no previous row, and a missing next row counts as 0 km).
+    """
+    km = np.asarray(kilometers, dtype=float)
+    prev = np.concatenate(([prev_km], km[:-1]))
+    next_ = np.concatenate((km[1:], [next_km]))
+
+    is_zero = km == 0
+    # Zero-km rows use the next row's distance
+    basis_km = np.where(is_zero, next_, km)
+    continuous = is_zero | (prev == 0)
+
+    return np.select(
+        [basis_km > 800, basis_km > 350, continuous],
+        ["มากกว่า 800 กม.", "มากกว่า 350 และน้อยว่า 800 กม.",
+         "น้อยกว่า 350 กม. (ต่อเนื่อง)"],
+        default="น้อยกว่า 350 กม.",
+    )
+
+
+# Default rate table file, edit this file (and its version) to change rates
+RATE_TABLE_PATH = os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), 'data', 'rate_table.json')
+
+# Compiled rate table: old/new rates are 2-D arrays indexed by
+# [distance category code, car type code], missing rates are NaN
+RateTable = namedtuple('RateTable', [
+    'version', 'sha256', 'categories', 'short_names', 'car_types',
+    'old_rates', 'new_rates'])
+
+# Compiled data files (rate tables, fleet registry) keyed by (path, mtime, size)
+_data_file_cache = {}
+
+# Legacy rate table row layout: columns (old rate, new rate) for each car type
+rate_columns = {
+    "full_23m": (3, 4),
+    "full_25m": (5, 6),
+    "flatbed": (7, 8),
+    "type_s": (9, 10),
+    "type_sb": (11, 12),
+}
+
+
+def _to_rate(value):
+    """Convert a rate table cell to float, missing rates become NaN"""
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return np.nan
+
+
+def compile_rate_table(rate_data, sha256=''):
+    """
+    Compile rate table data (as loaded from the JSON file) into a RateTable.
+    When a category is listed twice the first row wins.
+    """
+    car_types = list(rate_data['car_types'])
+    rates = []
+    seen = set()
+    for rate_row in rate_data['rates']:
+        if rate_row['category'] not in seen:
+            seen.add(rate_row['category'])
+            rates.append(rate_row)
+
+    old_rates = np.array([[_to_rate(v) for v in rate_row['old']]
+                          for rate_row in rates], dtype=float).reshape(-1, len(car_types))
+    new_rates = np.array([[_to_rate(v) for v in rate_row['new']]
+                          for rate_row in rates], dtype=float).reshape(-1, len(car_types))
+
+    return RateTable(
+        version=str(rate_data.get('version', '')),
+        sha256=sha256,
+        categories=pd.Index([rate_row['category'] for rate_row in rates]),
+        short_names=[rate_row.get('short_name', '') for rate_row in rates],
+        car_types=pd.Index(car_types),
+        old_rates=old_rates,
+        new_rates=new_rates,
+    )
+
+
+def _load_data_file(path, compile_content):
+    """
+    Compile a data file with compile_content(content_bytes, sha256) once per
+    process. The result is rebuilt only when the file's mtime or size changes.
+    """
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    key = (path, stat.st_mtime_ns, stat.st_size)
+    if key not in _data_file_cache:
+        with open(path, 'rb') as file:
+            content = file.read()
+        compiled = compile_content(
+            content, hashlib.sha256(content).hexdigest())
+        # Drop results compiled from older versions of the same file
+        for old_key in [k for k in _data_file_cache if k[0] == path]:
+            del _data_file_cache[old_key]
+        _data_file_cache[key] = compiled
+    return _data_file_cache[key]
+
+
+def load_rate_table(path=None):
+    """Load and compile a rate table file (cached per process)"""
+    return _load_data_file(
+        path or RATE_TABLE_PATH,
+        lambda content, sha256: compile_rate_table(
+            json.loads(content.decode('utf-8')), sha256=sha256))
+
+
+def rate_table_rows(rate_table):
+    """
+    Convert a compiled RateTable back to the legacy row layout used by
+    calculate_bonus, with '' for missing rates.
+    """
+    rows = []
+    for i, category in enumerate(rate_table.categories):
+        row = [i + 1, category, ""] + [""] * (2 * len(rate_columns))
+        for car_type, (old_col, new_col) in rate_columns.items():
+            if car_type in rate_table.car_types:
+                j = rate_table.car_types.get_loc(car_type)
+                for col, rates in ((old_col, rate_table.old_rates),
+                                   (new_col, rate_table.new_rates)):
+                    row[col] = "" if np.isnan(rates[i, j]) else float(rates[i, j])
+        rows.append(row + [rate_table.short_names[i]])
+    return rows
+
+
+def lookup_rates(rate_table, distance_categories, car_types):
+    """
+    Look up (old rates, new rates) for any number of rows with one gather.
+    Rows with an unknown category or car type get NaN.
+    """
+    cat_idx = rate_table.categories.get_indexer(distance_categories)
+    type_idx = rate_table.car_types.get_indexer(car_types)
+    found = (cat_idx >= 0) & (type_idx >= 0)
+    old_rate = np.where(found, rate_table.old_rates[cat_idx, type_idx], np.nan)
+    new_rate = np.where(found, rate_table.new_rates[cat_idx, type_idx], np.nan)
+    return old_rate, new_rate
+
+
+def override_rates(rate_table, spec):
+    """
+    Copy of rate_table with some rates replaced, for what-if scenarios.
+    spec is a comma-separated list of CAR_TYPE[:CATEGORY][:old|new]=RATE
+    changes: 'flatbed=6.2' sets the new flatbed rate of every distance
+    category, 'flatbed:ไกล:old=4.8' one old rate (CATEGORY is the category
+    or its short name).
+    """
+    old_rates = rate_table.old_rates.copy()
+    new_rates = rate_table.new_rates.copy()
+    for change in spec.split(','):
+        target, _, value = change.strip().rpartition('=')
+        parts = target.split(':')
+        which = parts.pop() if parts[-1] in ('old', 'new') else 'new'
+        if not parts or len(parts) > 2 or parts[0] not in rate_table.car_types:
+            raise ValueError(f"Invalid rate override: {change!r}")
+        rows = slice(None)
+        if len(parts) == 2:
+            if parts[1] in rate_table.categories:
+                rows = rate_table.categories.get_loc(parts[1])
+            elif parts[1] in rate_table.short_names:
+                rows = rate_table.short_names.index(parts[1])
+            else:
+                raise ValueError(f"Unknown distance category in rate override: {change!r}")
+        rates = old_rates if which == 'old' else new_rates
+        rates[rows, rate_table.car_types.get_loc(parts[0])] = float(value)
+
+    return rate_table._replace(
+        version=f"{rate_table.version} {spec}",
+        sha256=hashlib.sha256(f"{rate_table.sha256}|{spec}".encode()).hexdigest(),
+        old_rates=old_rates, new_rates=new_rates)
+
+
+# Fleet registry: car_types maps car number -> car type, overrides holds
+# date-effective entries as (car number, car type, start, end) tuples
+FleetRegistry = namedtuple('FleetRegistry', ['car_types', 'overrides'])
+
+
+def compile_fleet_registry(content, sha256=''):
+    """
+    Compile fleet.csv content. Rows without effective dates go into the
+    car_types dict; rows with effective_from/effective_to override the car
+    type for trips between those dates (inclusive).
+    """
+    car_types = {}
+    overrides = []
+    reader = csv.DictReader(io.StringIO(content.decode('utf-8-sig')))
+    for entry in reader:
+        car_number = (entry.get('car_number') or '').strip()
+        car_type = (entry.get('car_type') or '').strip()
+        if not car_number or car_type not in CAR_TYPES:
+            continue
+        start = (entry.get('effective_from') or '').strip()
+        end = (entry.get('effective_to') or '').strip()
+        if start or end:
+            overrides.append((
+                car_number, car_type,
+                pd.Timestamp(start) if start else pd.Timestamp.min,
+                pd.Timestamp(end) if end else pd.Timestamp.max))
+        else:
+            car_types.setdefault(car_number, car_type)
+    return FleetRegistry(car_types=car_types, overrides=overrides)
+
+
+def load_fleet_registry(path=None):
+    """Load and compile the fleet registry file (cached per process)"""
+    return _load_data_file(path or FLEET_PATH, compile_fleet_registry)
+
+
+def assign_car_types(car_numbers, trip_dates=None, fleet=None):
+    """
+    Map a column of car numbers to a categorical car type column.
+    Date-effective registry entries apply when trip_dates is given.
+    """
+    if fleet is None:
+        fleet = load_fleet_registry()
+
+    car_types = car_numbers.map(fleet.car_types).fillna("unknown")
+
+    if trip_dates is not None and fleet.overrides:
+        dates = parse_vis_dates(trip_dates)
+        for car_number, car_type, start, end in fleet.overrides:
+            # effective_to is inclusive: a trip at any time that day matches
+            mask = (car_numbers == car_number) & (
+                dates >= start) & (dates.dt.normalize() <= end)
+            if mask.any():
+                car_types = car_types.mask(mask, car_type)
+
+    return car_types.astype(pd.CategoricalDtype(CAR_TYPES))
+
+
+def bonus_liters(kilometers, actual_rate, old_rate, new_rate):
+    """
+    The calculate_bonus rules on arrays. old_rate/new_rate may carry leading
+    scenario axes (e.g. shape (rate tables, rows)) and broadcast against the
+    per-row kilometers/actual_rate. Rows without a rate or kilometers get 0.
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Calculate expected fuel usage
+        expected_old = kilometers / old_rate  # Bottom ceiling (more fuel)
+        expected_new = kilometers / new_rate  # Top ceiling (less fuel)
+        actual_used = np.where(actual_rate > 0, kilometers / actual_rate, 0)
+
+        # Calculate bonus based on the same rules as calculate_bonus
+        bonus = np.select(
+            [actual_rate > new_rate, actual_rate > old_rate],
+            [
+                # Better than new rate
+                (expected_old - expected_new) * 0.75
+                + (expected_new - actual_used) * 0.5,
+                # Between old and new rate
+                (expected_old - actual_used) * 0.75
+                - (actual_used - expected_new),
+            ],
+            # Worse than old rate: driver pays back 100% below ceiling
+            default=-(actual_used - expected_new),
+        )
+
+    valid = (~np.isnan(old_rate) & ~np.isnan(new_rate)
+             & ~np.isnan(actual_rate) & (kilometers != 0))
+    return np.where(valid, bonus, 0.0)
+
+
+def calculate_bonus_vectorized(df, rate_table):
+    """
+    Columnar version of calculate_bonus: returns the bonus (liters) for every
+    row of df as a NumPy array, using a compiled RateTable. Rows whose rate
+    is missing from the rate table get 0, the same as when calculate_bonus
+    cannot find a rate.
+    """
+    if "เรท" not in df.columns or "ประเภทรถ" not in df.columns:
+        return np.zeros(len(df))
+
+    kilometers = pd.to_numeric(df["กิโลเมตร"], errors='coerce').to_numpy(
+        dtype=float)
+    actual_rate = pd.to_numeric(df["เรท"], errors='coerce').to_numpy(
+        dtype=float)
+
+    # Look up old/new rates for every row in one gather
+    old_rate, new_rate = lookup_rates(
+        rate_table, df["ประเภทระยะทาง"], df["ประเภทรถ"])
+
+    bonus = bonus_liters(kilometers, actual_rate, old_rate, new_rate)
+
+    if row_logger.isEnabledFor(logging.DEBUG):
+        # Same line calculate_bonus logs for rows worse than the old rate
+        with np.errstate(divide='ignore', invalid='ignore'):
+            expected_new = kilometers / new_rate
+            actual_used = np.where(actual_rate > 0, kilometers / actual_rate, 0)
+        worse = np.flatnonzero(~np.isnan(old_rate) & ~np.isnan(new_rate)
+                               & ~np.isnan(actual_rate) & (kilometers != 0)
+                               & ~(actual_rate > new_rate)
+                               & ~(actual_rate > old_rate))
+        distance_cats = df["ประเภทระยะทาง"].to_numpy()
+        for i in worse:
+            row_logger.debug("%s %s %s %s %s %s %s", distance_cats[i],
+                             actual_used[i], actual_rate[i], expected_new[i],
+                             new_rate[i], actual_used[i] - expected_new[i],
+                             bonus[i])
     return bonus
 
 
-def process_driver_data(df, all_job_counts, oil_price):
-    # Define rate table from the provided information
-    rate_table = [
-        [1, "น้อยกว่า 350 กม. (ต่อเนื่อง)", "", 3.80, 4.00, 3.80, 3.90, 4.50,
-            5.00, 5.50, 6.00, 6.00, 7.50, "ใกล้(ต่อเนื่อง)"],
-        [2, "น้อยกว่า 350 กม.", "", 3.80, 4.20, 3.80, 4.10,
-            4.50, 5.50, 5.50, 6.00, 6.00, 7.50, "ใกล้"],
-        [3, "มากกว่า 350 และน้อยว่า 800 กม.", "", 3.80, 4.40, 3.80,
-            4.30, 4.50, 6.00, 5.50, 6.50, 6.00, 7.50, "กลาง"],
-        [4, "มากกว่า 800 กม.", "", 3.80, 4.60, 3.80,
-            4.50, 4.50, 6.40, 5.50, 7.00, 6.00, "", "ไกล"]
-    ]
+def process_driver_data(df, all_job_counts, oil_price, rate_table=None,
+                        driver_km_totals=None, km_bonus_paid=None,
+                        prev_km=np.nan, next_km=0.0):
+    """
+    Process one VIS table: categorize trips and calculate fuel and KM bonuses.
+
+    driver_km_totals (driver name -> total km) lets the KM bonus use totals
+    from the whole run instead of this table only. km_bonus_paid is a set of
+    drivers whose KM bonus row was already assigned in earlier tables; it is
+    updated with the drivers of this table.
+    When df is a chunk of a longer table, prev_km/next_km are the kilometers
+    of the rows just before and after it (see categorize_distance).
+    """
+    started = time.perf_counter()
+
+    # Use the default rate table unless another one is given
+    if rate_table is None:
+        rate_table = load_rate_table()
 
     # Reset index to make sure we can iterate reliably
     df = df.reset_index(drop=True)
 
-    # Rename columns to match expected names
-    column_mapping = {
-        'ชื่อ พขร.': 'ชื่อ-นามสกุล',  # Map the actual driver name column to expected name
-        # Fix the spacing issue in column name
-        'น้ำม                      มัน(ลิตร)': 'น้ำมัน(ลิตร)'
-    }
-
-    df = df.rename(columns=column_mapping)
+    # Parsed tables already have canonical column names, other frames may not
+    df = df.rename(columns=canonical_header)
 
     # Normalize driver names if the driver name column exists
-    if 'ชื่อ พขร.' in df.columns:
-        df['ชื่อ พขร.'] = df['ชื่อ พขร.'].apply(normalize_driver_name)
-    elif 'ชื่อ-นามสกุล' in df.columns:
-        df['ชื่อ-นามสกุล'] = df['ชื่อ-นามสกุล'].apply(normalize_driver_name)
+    if 'ชื่อ-นามสกุล' in df.columns:
+        df['ชื่อ-นามสกุล'] = normalize_driver_names(df['ชื่อ-นามสกุล'])
 
     # Flag rows that match the zero calculation sources but don't set them to zero yet
     special_case_mask = None
     if 'ต้นทาง' in df.columns:
         # Create a mask for rows that match any of the special terms
-        special_case_mask = df['ต้นทาง'].str.contains('|'.join(zero_calculation_sources),
-                                                      case=False,
-                                                      na=False)
-        print(f"Found {special_case_mask.sum()} rows with special source values that will have zero calculations after categorization")
+        special_case_mask = special_source_mask(df['ต้นทาง'])
+        logger.debug("Found %d rows with special source values that will have zero calculations after categorization",
+                     special_case_mask.sum())
 
     # Ensure numeric columns are properly converted with safe handling
     try:
-        df["กิโลเมตร"] = pd.to_numeric(df["กิโลเมตร"].astype(str).str.replace(
-            ',', '').replace('', '0'), errors='coerce').fillna(0)
-        df["เรท"] = pd.to_numeric(df["เรท"].astype(str).str.replace(
-            ',', '').replace('', '0'), errors='coerce').fillna(0)
+        df["กิโลเมตร"] = to_number(df["กิโลเมตร"])
+        df["เรท"] = to_number(df["เรท"])
         if "น้ำมัน(ลิตร)" in df.columns:
-            df["น้ำมัน(ลิตร)"] = pd.to_numeric(df["น้ำมัน(ลิตร)"].astype(
-                str).str.replace(',', '').replace('', '0'), errors='coerce').fillna(0)
+            df["น้ำมัน(ลิตร)"] = to_number(df["น้ำมัน(ลิตร)"])
     except KeyError as e:
-        print(
-            f"Warning: Column not found - {e}. Continuing with available columns.")
+        logger.warning(
+            "Warning: Column not found - %s. Continuing with available columns.", e)
 
     # Add car type column if เบอร์รถ exists
     if "เบอร์รถ" in df.columns:
+        trip_dates = df["วันที่"] if "วันที่" in df.columns else None
         df.insert(df.columns.get_loc("เบอร์รถ") + 1,
-                  "ประเภทรถ", df["เบอร์รถ"].apply(get_car_type))
+                  "ประเภทรถ", assign_car_types(df["เบอร์รถ"], trip_dates))
 
     # Add drivers count column next to 'เลข Job' if it exists
     if "เลข Job" in df.columns:
         df.insert(df.columns.get_loc("เลข Job") + 1,
                   "จำนวน พขร.", df["เลข Job"].map(all_job_counts))
 
+    record_stage('normalize', time.perf_counter() - started, len(df))
+
     # Create a new column for distance category if กิโลเมตร exists
     if "กิโลเมตร" in df.columns:
-        # Calculate total kilometers per driver for KM bonus
-        if "ชื่อ-นามสกุล" in df.columns:
-            driver_total_km = df.groupby(
-                "ชื่อ-นามสกุล")["กิโลเมตร"].sum().to_dict()
-            # Add a new column for total kilometers for each driver
-            df["รวมกิโลเมตร"] = df["ชื่อ-นามสกุล"].map(driver_total_km)
-            # Add km bonus column based on total kilometers
-            df["โบนัสกิโลเมตร"] = df.apply(
-                lambda row: get_km_bonus(
-                    row["ชื่อ-นามสกุล"], row["รวมกิโลเมตร"])
-                if pd.notna(row["ชื่อ-นามสกุล"]) else 0,
-                axis=1
-            )
-            # Since we only want to count the bonus once per driver, we'll only
-            # apply it to the first occurrence of each driver
-            driver_first_occurrence = {}
-            for i, row in df.iterrows():
-                driver_name = row["ชื่อ-นามสกุล"]
-                if pd.notna(driver_name):
-                    if driver_name not in driver_first_occurrence:
-                        driver_first_occurrence[driver_name] = i
-                    elif i != driver_first_occurrence[driver_name]:
-                        df.at[i, "โบนัสกิโลเมตร"] = 0
-
-        distance_categories = []
-
-        for i in range(len(df)):
-            km = df.loc[i, "กิโลเมตร"]
-
-            # Skip the zero calculation check for trip categorization
-            # This way, zero calculation sources won't trigger continuous trip logic
-
-            if km == 0:
-                # Check if this is part of a continuous trip
-                if i < len(df) - 1:  # Make sure there's a next row
-                    next_km = df.loc[i + 1, "กิโลเมตร"]
-
-                    # Mark both current and next row
-                    if next_km > 800:
-                        distance_categories.append("มากกว่า 800 กม.")
-                    elif next_km > 350:
-                        distance_categories.append(
-                            "มากกว่า 350 และน้อยว่า 800 กม.")
-                    else:
-                        distance_categories.append(
-                            "น้อยกว่า 350 กม. (ต่อเนื่อง)")
-                else:
-                    # Last row with 0 km
-                    distance_categories.append("น้อยกว่า 350 กม. (ต่อเนื่อง)")
-            else:
-                # Check if previous row had 0 km (part of continuous trip)
-                if i > 0 and df.loc[i - 1, "กิโลเมตร"] == 0:
-                    if km > 800:
-                        distance_categories.append("มากกว่า 800 กม.")
-                    elif km > 350:
-                        distance_categories.append(
-                            "มากกว่า 350 และน้อยว่า 800 กม.")
-                    else:
-                        distance_categories.append(
-                            "น้อยกว่า 350 กม. (ต่อเนื่อง)")
-                else:
-                    # Regular categorization
-                    if km > 800:
-                        distance_categories.append("มากกว่า 800 กม.")
-                    elif km > 350:
-                        distance_categories.append(
-                            "มากกว่า 350 และน้อยว่า 800 กม.")
-                    else:
-                        distance_categories.append("น้อยกว่า 350 กม.")
+        started = time.perf_counter()
+        distance_categories = categorize_distance(df["กิโลเมตร"], prev_km, next_km)
 
         # Insert the distance category column after กิโลเมตร
         df.insert(df.columns.get_loc("กิโลเมตร") + 1,
                   "ประเภทระยะทาง", distance_categories)
+        record_stage('categorize', time.perf_counter() - started, len(df))
+
+        started = time.perf_counter()
+        # Calculate total kilometers per driver for KM bonus
+        if "ชื่อ-นามสกุล" in df.columns:
+            if driver_km_totals is None:
+                driver_km_totals = table_driver_km_totals(df)
+            # Add a new column for total kilometers for each driver
+            df["รวมกิโลเมตร"] = df["ชื่อ-นามสกุล"].map(
+                driver_km_totals.astype(float))
+            # Add km bonus column based on total kilometers, counted once per driver
+            df["โบนัสกิโลเมตร"] = km_bonus_column(
+                df["ชื่อ-นามสกุล"], df["รวมกิโลเมตร"], km_bonus_paid)
 
         # NOW apply the zero calculation sources mask AFTER the categorization is done
         if special_case_mask is not None and special_case_mask.any():
@@ -291,15 +725,14 @@ def process_driver_data(df, all_job_counts, oil_price):
             if 'เรท' in df.columns:
                 df.loc[special_case_mask, 'เรท'] = 0
 
-        # Calculate bonus for each row
-        df["เบี้ยคำนวณ"] = df.apply(lambda row: calculate_bonus(
-            row, rate_table) if "เรท" in row and pd.notna(row["เรท"]) and row["เรท"] != "" else 0, axis=1)
+        # Calculate bonus for all rows at once
+        bonus = calculate_bonus_vectorized(df, rate_table)
 
         # Divide bonus by 2 if จำนวน พขร. is 2
         if "จำนวน พขร." in df.columns:
-            df["เบี้ยคำนวณ"] = df.apply(lambda row: row["เบี้ยคำนวณ"] / 2
-                                        if pd.notna(row["จำนวน พขร."]) and row["จำนวน พขร."] == 2
-                                        else row["เบี้ยคำนวณ"], axis=1)
+            bonus = np.where(df["จำนวน พขร."] == 2, bonus / 2, bonus)
+
+        df["เบี้ยคำนวณ"] = bonus
 
         # Add column with bonus multiplied by oil price
         df["เบี้ยคำนวณ x ราคาน้ำมัน"] = df["เบี้ยคำนวณ"] * oil_price
@@ -308,18 +741,605 @@ def process_driver_data(df, all_job_counts, oil_price):
         if "โบนัสกิโลเมตร" in df.columns:
             df["รวมโบนัสทั้งหมด"] = df["เบี้ยคำนวณ x ราคาน้ำมัน"] + \
                 df["โบนัสกิโลเมตร"]
+        record_stage('bonus', time.perf_counter() - started, len(df))
 
     return df
 
 
-def html_to_excel():
+def build_driver_tables(tables):
+    """
+    Turn parsed (table_index, headers, rows) tables into DataFrames, skipping
+    tables without headers, data rows or the required columns.
+    Returns a list of (table_index, df).
+    """
+    driver_tables = []
+    for table_index, headers, rows in tables:
+        if headers is None:
+            logger.info("Table %s has insufficient rows, skipping", table_index)
+            continue
+
+        if not headers:
+            logger.info("Table %s has no header cells, skipping", table_index)
+            continue
+
+        logger.debug("Table %s headers: %s", table_index, headers)
+
+        if len(rows) == 0:
+            logger.info("Table %s has no data rows, skipping", table_index)
+            continue
+
+        logger.info("Table %s has %d data rows", table_index, len(rows))
+
+        # Create DataFrame (cached parse results already are one)
+        if isinstance(rows, pd.DataFrame):
+            df = rows
+        else:
+            df = pd.DataFrame(rows, columns=headers)
+
+        if has_required_columns(table_index, df.columns):
+            driver_tables.append((table_index, df))
+    return driver_tables
+
+
+def has_required_columns(table_index, columns):
+    """Check a table has the columns needed for processing, warn when it doesn't"""
+    # Check if required columns exist for processing (using more flexible column matching)
+    required_base_columns = ['เบอร์รถ', 'กิโลเมตร', 'เลข Job']
+
+    # Check for driver name column with alternative names
+    driver_name_columns = ['ชื่อ-นามสกุล', 'ชื่อ พขร.', 'พขร.']
+    has_driver_name = any(col in columns for col in driver_name_columns)
+
+    missing_base_columns = [
+        col for col in required_base_columns if col not in columns]
+
+    if missing_base_columns or not has_driver_name:
+        logger.warning("Table %s missing required columns: %s",
+                       table_index, missing_base_columns)
+        if not has_driver_name:
+            logger.warning("Missing driver name column")
+        logger.warning("Skipping this table")
+        return False
+    return True
+
+
+def processed_columns(driver_tables, oil_price):
+    """
+    Columns of the combined output, in order of first appearance, found by
+    running process_driver_data on the empty header of every table
+    """
+    columns = {}
+    # A throwaway metrics collector keeps the dry run out of the run's stages
+    with collect_metrics(), quiet_logs():
+        for _, df in driver_tables:
+            columns.update(dict.fromkeys(
+                process_driver_data(df.iloc[:0], {}, oil_price).columns))
+    return list(columns)
+
+
+def summarize_drivers(processed_df):
+    """
+    Per-driver totals for one processed table, indexed by driver name in
+    order of appearance: fuel_bonus is the exact sum of the fuel bonus in
+    baht (a Fraction, see vis_sums), km_bonus the driver's KM bonus
+    """
+    names = processed_df['ชื่อ-นามสกุล']
+    drivers = (names.notna() & (names != '')).to_numpy()
+    codes, uniques = pd.factorize(names[drivers], sort=False)
+    fuel_bonus = (processed_df['เบี้ยคำนวณ x ราคาน้ำมัน'].to_numpy(dtype=float)[drivers]
+                  if 'เบี้ยคำนวณ x ราคาน้ำมัน' in processed_df.columns
+                  else np.zeros(len(codes)))
+    km_bonus = (processed_df['โบนัสกิโลเมตร'].to_numpy()[drivers]
+                if 'โบนัสกิโลเมตร' in processed_df.columns
+                else np.zeros(len(codes), dtype=int))
+    return _driver_summary(uniques, exact_sums(fuel_bonus, codes, len(uniques)),
+                           pd.Series(km_bonus).groupby(codes).max())
+
+
+def _driver_summary(names, fuel_bonus, km_bonus):
+    return pd.DataFrame(
+        {'fuel_bonus': pd.Series(fuel_bonus, dtype=object).to_numpy(),
+         'km_bonus': np.asarray(km_bonus)},
+        index=pd.Index(np.asarray(names, dtype=object), name='ชื่อ-นามสกุล'))
+
+
+def merge_driver_summaries(driver_summaries, table_summary):
+    """
+    Merge one table's driver totals into the running summary: fuel bonuses
+    add up exactly, the KM bonus is paid on one row per driver so the
+    largest is kept
+    """
+    if driver_summaries is None:
+        return table_summary
+    combined = pd.concat([driver_summaries, table_summary])
+    codes, uniques = pd.factorize(combined.index, sort=False)
+    fuel_bonus = [0] * len(uniques)
+    for code, value in zip(codes.tolist(), combined['fuel_bonus'].tolist()):
+        fuel_bonus[code] += value
+    return _driver_summary(uniques, fuel_bonus,
+                           combined['km_bonus'].groupby(codes).max())
+
+
+def driver_summary_frame(driver_summaries):
+    """Build the Driver_Summary sheet (with a grand total row) from the running summary"""
+    summary_df = pd.DataFrame({
+        'ชื่อ-นามสกุล': driver_summaries.index.to_numpy(),
+        'เบี้ยประหยัดน้ำมัน': [to_float(total) for total in driver_summaries['fuel_bonus']],
+        'โบนัสกิโลเมตร': driver_summaries['km_bonus'].to_numpy(),
+    })
+    summary_df['รวมโบนัสทั้งหมด'] = summary_df['เบี้ยประหยัดน้ำมัน'] + \
+        summary_df['โบนัสกิโลเมตร']
+
+    # Calculate totals
+    summary_totals = {
+        'ชื่อ-นามสกุล': 'รวมทั้งหมด',
+        'เบี้ยประหยัดน้ำมัน': summary_df['เบี้ยประหยัดน้ำมัน'].sum(),
+        'โบนัสกิโลเมตร': summary_df['โบนัสกิโลเมตร'].sum(),
+        'รวมโบนัสทั้งหมด': summary_df['รวมโบนัสทั้งหมด'].sum()
+    }
+
+    # Add total row to summary
+    return pd.concat(
+        [summary_df, pd.DataFrame([summary_totals])], ignore_index=True)
+
+
+def iter_processed_tables(driver_tables, job_counts, oil_price, rate_table=None,
+                          driver_km_totals=None, km_bonus_paid=None):
+    """
+    Run process_driver_data over the tables of one export and yield
+    (table_index, processed_df) one table at a time, with compact dtypes
+    (see vis_schema).
+    KM bonus totals cover all the tables unless run-wide driver_km_totals
+    are given; km_bonus_paid is copied, not updated.
+    """
+    if driver_km_totals is None:
+        driver_km_totals = merge_km_totals(
+            table_driver_km_totals(df) for _, df in driver_tables)
+    km_bonus_paid = set(km_bonus_paid or ())
+    job_counts = job_count_lookup(job_counts)
+
+    for table_index, df in driver_tables:
+        processed_df = process_driver_data(
+            df, job_counts, oil_price, rate_table,
+            driver_km_totals=driver_km_totals, km_bonus_paid=km_bonus_paid)
+        processed_df, bytes_saved = compact_dtypes(processed_df)
+        logger.debug("Table %s compact dtypes saved %d bytes",
+                     table_index, bytes_saved)
+        yield table_index, processed_df
+
+
+def scan_table_chunks(input_file, chunk_rows=CHUNK_ROWS):
+    """
+    First pass of chunked processing: stream the export chunk_rows rows at
+    a time and collect what rows depend on beyond their neighbours.
+    Returns (job_counts, driver_km_totals, driver_tables, crews) where
+    driver_tables holds a header-only frame of every processable table and
+    crews their job_crews().
+    """
+    job_counts = {}
+    driver_km_totals = pd.Series(dtype=object)
+    driver_tables = {}
+    crews = []
+    for table_index, headers, rows, table_job_counts in iter_vis_tables(
+            input_file, chunk_rows=chunk_rows):
+        merge_job_counts(job_counts, table_job_counts)
+        if not headers or not rows:
+            continue
+        df = pd.DataFrame(rows, columns=headers)
+        if table_index not in driver_tables:
+            driver_tables[table_index] = (
+                df.iloc[:0] if has_required_columns(table_index, df.columns) else None)
+        if driver_tables[table_index] is not None:
+            driver_km_totals = merge_km_totals(
+                [driver_km_totals, table_driver_km_totals(df)])
+            crews.append(job_crews(df))
+    driver_tables = [(table_index, df) for table_index, df in driver_tables.items()
+                     if df is not None]
+    return job_counts, driver_km_totals, driver_tables, merge_job_crews(crews)
+
+
+def iter_table_chunks(input_file, table_indexes, chunk_rows=CHUNK_ROWS):
+    """
+    Second pass of chunked processing: yield (table_index, df, next_km, last)
+    for every non-empty chunk of the given tables, where next_km is the
+    kilometers of the row after the chunk and last marks a table's final
+    chunk (next_km is then 0). Chunks are yielded once the following chunk
+    has been read.
+    """
+    pending = None
+    for table_index, headers, rows, _ in iter_vis_tables(input_file, chunk_rows=chunk_rows):
+        if table_index not in table_indexes or not headers or not rows:
+            continue
+        df = pd.DataFrame(rows, columns=headers)
+        if pending is not None:
+            pending_index, pending_df = pending
+            if pending_index == table_index:
+                yield (pending_index, pending_df,
+                       to_number(df['กิโลเมตร'].iloc[:1]).iloc[0], False)
+            else:
+                yield pending_index, pending_df, 0.0, True
+        pending = (table_index, df)
+    if pending is not None:
+        yield pending[0], pending[1], 0.0, True
+
+
+def iter_processed_chunks(input_file, oil_price, rate_table=None,
+                          chunk_rows=CHUNK_ROWS, driver_km_totals=None,
+                          km_bonus_paid=None, scan=None, pipeline_depth=0):
+    """
+    Bounded-memory counterpart of iter_processed_tables for exports whose
+    tables don't fit in memory: yields (table_index, processed_chunk, last)
+    with at most chunk_rows rows each, last marking a table's final chunk.
+    The export is read twice - first for the job counts and driver km
+    totals (scan_table_chunks, or scan when already done), then chunk by
+    chunk carrying the neighbouring kilometers and the drivers whose KM bonus
+    was paid - so the rows equal those of processing each table whole.
+    With pipeline_depth the second pass parses in a background thread, up
+    to that many chunks ahead of the processing (see vis_pipeline).
+    """
+    job_counts, file_km_totals, driver_tables, _ = scan or scan_table_chunks(
+        input_file, chunk_rows)
+    if driver_km_totals is None:
+        driver_km_totals = file_km_totals
+    driver_km_totals = driver_km_totals.astype(float)
+    km_bonus_paid = set(km_bonus_paid or ())
+    job_counts = job_count_lookup(job_counts)
+
+    # Kilometers of the row before the chunk, none at the start of a table
+    prev_km = np.nan
+    chunks = iter_table_chunks(
+        input_file, {table_index for table_index, _ in driver_tables}, chunk_rows)
+    for table_index, df, next_km, last in pipelined(chunks, pipeline_depth, 'vis-parse'):
+        processed_df = process_driver_data(
+            df, job_counts, oil_price, rate_table,
+            driver_km_totals=driver_km_totals, km_bonus_paid=km_bonus_paid,
+            prev_km=prev_km, next_km=next_km)
+        prev_km = np.nan if last else to_number(df['กิโลเมตร'].iloc[-1:]).iloc[0]
+        yield table_index, compact_dtypes(processed_df)[0], last
+
+
+def process_html(html, oil_price, rate_table=None, driver_km_totals=None,
+                 km_bonus_paid=None):
+    """
+    Calculate the bonuses of an in-memory VIS export (HTML text, bytes
+    in a sniffed encoding or a file-like object) without touching the filesystem.
+    Returns (combined_df, summary_df): the processed rows of every table
+    with a 'ตาราง' table index column (no total or separator rows), and the
+    Driver_Summary frame. Both are empty when there is nothing to process.
+    """
+    tables, job_counts = parse_html(html)
+    driver_tables = build_driver_tables(tables)
+    del tables
+
+    frames = []
+    driver_summaries = None
+    for table_index, processed_df in iter_processed_tables(
+            driver_tables, job_counts, oil_price, rate_table,
+            driver_km_totals, km_bonus_paid):
+        if 'ชื่อ-นามสกุล' in processed_df.columns:
+            with stage('aggregate', len(processed_df)):
+                driver_summaries = merge_driver_summaries(
+                    driver_summaries, summarize_drivers(processed_df))
+        frames.append(processed_df.assign(ตาราง=np.int32(table_index)))
+
+    if not frames:
+        return pd.DataFrame(), pd.DataFrame()
+    columns = ['ตาราง'] + processed_columns(driver_tables, oil_price)
+    combined_df = concat_compact(frames).reindex(columns=columns)
+    if driver_summaries is None or driver_summaries.empty:
+        return combined_df, pd.DataFrame()
+    return combined_df, driver_summary_frame(driver_summaries)
+
+
+# One what-if case of scenario mode: an oil price and a compiled rate table
+Scenario = namedtuple('Scenario', ['name', 'oil_price', 'rate_table'])
+
+
+def build_scenarios(oil_prices, rate_tables):
+    """
+    Every combination of oil price and (label, RateTable). Scenario names
+    are the oil price, prefixed with the rate table label when there is
+    more than one rate table.
+    """
+    return [Scenario(f"{oil_price:g} บาท" if len(rate_tables) == 1
+                     else f"{label} @ {oil_price:g} บาท", oil_price, rate_table)
+            for label, rate_table in rate_tables for oil_price in oil_prices]
+
+
+def scenario_liters(processed_df, rate_tables):
+    """
+    Bonus liters of every row of a processed table under each rate table,
+    as an array of shape (rate tables, rows). The rates of all tables are
+    gathered into a scenario axis and the bonus rules broadcast over it.
+    """
+    if "เรท" not in processed_df.columns or "ประเภทรถ" not in processed_df.columns:
+        return np.zeros((len(rate_tables), len(processed_df)))
+
+    kilometers = pd.to_numeric(processed_df["กิโลเมตร"], errors='coerce').to_numpy(
+        dtype=float)
+    actual_rate = pd.to_numeric(processed_df["เรท"], errors='coerce').to_numpy(
+        dtype=float)
+    rates = [lookup_rates(rate_table, processed_df["ประเภทระยะทาง"],
+                          processed_df["ประเภทรถ"]) for rate_table in rate_tables]
+    liters = bonus_liters(kilometers, actual_rate,
+                          np.stack([old_rate for old_rate, _ in rates]),
+                          np.stack([new_rate for _, new_rate in rates]))
+
+    # Divide bonus by 2 if จำนวน พขร. is 2
+    if "จำนวน พขร." in processed_df.columns:
+        liters = np.where(processed_df["จำนวน พขร."].to_numpy() == 2,
+                          liters / 2, liters)
+    return liters
+
+
+def compare_scenarios(driver_tables, job_counts, scenarios, driver_km_totals=None,
+                      km_bonus_paid=None):
+    """
+    Fuel bonus of every driver under every scenario, from one pass over the
+    tables: trips are categorized once, bonus liters are computed once per
+    distinct rate table and summed per driver, and only the per-driver
+    totals are multiplied by the oil prices.
+    Returns a frame with the driver, the KM bonus and one fuel bonus column
+    (baht) per scenario, plus a 'รวมทั้งหมด' total row.
+    """
+    # RateTables hold arrays, so distinct tables are found by identity
+    rate_tables = []
+    for scenario in scenarios:
+        if not any(scenario.rate_table is rate_table for rate_table in rate_tables):
+            rate_tables.append(scenario.rate_table)
+    rate_index = [next(i for i, rate_table in enumerate(rate_tables)
+                       if scenario.rate_table is rate_table) for scenario in scenarios]
+    liter_columns = list(range(len(rate_tables)))
+
+    driver_totals = None
+    for _, processed_df in iter_processed_tables(
+            driver_tables, job_counts, scenarios[0].oil_price, rate_tables[0],
+            driver_km_totals, km_bonus_paid):
+        if 'ชื่อ-นามสกุล' not in processed_df.columns:
+            continue
+        with stage('scenarios', len(processed_df)):
+            names = processed_df['ชื่อ-นามสกุล']
+            drivers = (names.notna() & (names != '')).to_numpy()
+            table_totals = pd.DataFrame(
+                scenario_liters(processed_df, rate_tables)[:, drivers].T,
+                columns=liter_columns)
+            table_totals['km_bonus'] = processed_df['โบนัสกิโลเมตร'].to_numpy()[drivers] \
+                if 'โบนัสกิโลเมตร' in processed_df.columns else 0
+            table_totals.index = names[drivers].to_numpy()
+            if driver_totals is not None:
+                table_totals = pd.concat([driver_totals, table_totals])
+            driver_totals = table_totals.groupby(level=0, sort=False).agg(
+                {**{column: 'sum' for column in liter_columns}, 'km_bonus': 'max'})
+
+    columns = ['ชื่อ-นามสกุล', 'โบนัสกิโลเมตร'] + [scenario.name for scenario in scenarios]
+    if driver_totals is None:
+        return pd.DataFrame(columns=columns)
+
+    # (drivers, rate tables) liters -> (drivers, scenarios) baht
+    fuel_bonus = (driver_totals[liter_columns].to_numpy()[:, rate_index]
+                  * np.array([scenario.oil_price for scenario in scenarios]))
+    comparison_df = pd.DataFrame(fuel_bonus, columns=columns[2:])
+    comparison_df.insert(0, 'ชื่อ-นามสกุล', driver_totals.index.to_numpy())
+    comparison_df.insert(1, 'โบนัสกิโลเมตร', driver_totals['km_bonus'].to_numpy())
+
+    totals = comparison_df[columns[1:]].sum().to_dict()
+    totals['ชื่อ-นามสกุล'] = 'รวมทั้งหมด'
+    return pd.concat([comparison_df, pd.DataFrame([totals])], ignore_index=True)
+
+
+def process_file(input_file, oil_price, output_path="processed_data_with_km_bonus.xlsx",
+                 *, driver_km_totals=None, km_bonus_paid=None, output_format='xlsx',
+                 cache_dir=None, cache_max_bytes=DEFAULT_CACHE_MAX_BYTES,
+                 scenarios=None, chunk_rows=None, store_path=None,
+                 pipeline_depth=PIPELINE_DEPTH, job_registry=None,
+                 breakdowns=None, cube_path=None):
+    """
+    Process one VIS export and write the result to output_path as xlsx,
+    csv or parquet. The keyword options are those of the command line
+    (see main); driver_km_totals/km_bonus_paid carry KM bonus state from
+    other files of the run (see process_driver_data).
+    Returns a status dict: file, status, tables, rows, seconds, output, error
+    and metrics (per-stage wall time, rows and peak RSS).
+    """
+    started = time.perf_counter()
+    result = {'file': input_file, 'status': 'error', 'tables': 0, 'rows': 0,
+              'seconds': 0.0, 'output': None, 'error': None, 'metrics': {}}
+    with collect_metrics() as metrics:
+        try:
+            return _process_file(
+                input_file, oil_price, output_path, result,
+                driver_km_totals=driver_km_totals, km_bonus_paid=km_bonus_paid,
+                output_format=output_format, cache_dir=cache_dir,
+                cache_max_bytes=cache_max_bytes, scenarios=scenarios,
+                chunk_rows=chunk_rows, store_path=store_path,
+                pipeline_depth=pipeline_depth, job_registry=job_registry,
+                breakdowns=breakdowns, cube_path=cube_path)
+        except Exception as e:
+            logger.exception("Error: %s", e)
+            result['status'] = 'error'
+            result['error'] = str(e)
+            return result
+        finally:
+            result['seconds'] = time.perf_counter() - started
+            result['metrics'] = metrics.as_dict()
+
+
+def _process_file(input_file, oil_price, output_path, result,
+                  *, driver_km_totals=None, km_bonus_paid=None, output_format='xlsx',
+                  cache_dir=None, cache_max_bytes=DEFAULT_CACHE_MAX_BYTES,
+                  scenarios=None, chunk_rows=None, store_path=None,
+                  pipeline_depth=PIPELINE_DEPTH, job_registry=None,
+                  breakdowns=None, cube_path=None):
+    if chunk_rows:
+        # Oversized exports: two streaming passes, chunk_rows rows at a time
+        try:
+            scan = scan_table_chunks(input_file, chunk_rows)
+            logger.info("HTML file '%s' scanned in chunks of %d rows",
+                        input_file, chunk_rows)
+        except Exception as e:
+            logger.error("Error reading HTML file: %s", e)
+            result['status'] = 'error'
+            result['error'] = f"Error reading HTML file: {e}"
+            return result
+        job_counts, file_km_totals, driver_tables, crews = scan
+        logger.info("Collected %d unique job numbers", len(job_counts))
+        if job_registry:
+            job_counts = registry_job_counts(job_counts, crews, job_registry)
+            scan = (job_counts, file_km_totals, driver_tables, crews)
+        processed = iter_processed_chunks(
+            input_file, oil_price, chunk_rows=chunk_rows,
+            driver_km_totals=driver_km_totals, km_bonus_paid=km_bonus_paid,
+            scan=scan, pipeline_depth=pipeline_depth)
+    else:
+        # Stream the HTML file table by table (or load it from the parse cache),
+        # counting job numbers as we go
+        try:
+            tables, job_counts, from_cache = read_tables(
+                input_file, cache_dir, cache_max_bytes)
+            if from_cache:
+                logger.info("HTML file '%s' loaded from the parse cache", input_file)
+            else:
+                logger.info("HTML file '%s' loaded successfully", input_file)
+        except Exception as e:
+            logger.error("Error reading HTML file: %s", e)
+            result['status'] = 'error'
+            result['error'] = f"Error reading HTML file: {e}"
+            return result
+
+        logger.info("Found %d tables in the HTML file", len(tables))
+
+        if len(tables) == 0:
+            logger.warning("No tables found in the HTML file")
+            result['status'] = 'no tables'
+            return result
+
+        logger.info("Collected %d unique job numbers", len(job_counts))
+
+        driver_tables = build_driver_tables(tables)
+        del tables
+
+        if job_registry:
+            job_counts = registry_job_counts(
+                job_counts, merge_job_crews(job_crews(df) for _, df in driver_tables),
+                job_registry)
+
+        if scenarios:
+            if not driver_tables:
+                logger.warning("No tables were successfully processed")
+                result['status'] = 'no tables'
+                return result
+            comparison_df = compare_scenarios(driver_tables, job_counts, scenarios,
+                                              driver_km_totals, km_bonus_paid)
+            with stage('write', len(comparison_df)):
+                write_frame(comparison_df, output_path, 'Scenarios', output_format)
+            logger.info("Saved %d scenarios to %s", len(scenarios), output_path)
+            result['status'] = 'ok'
+            result['tables'] = len(driver_tables)
+            result['rows'] = sum(len(df) for _, df in driver_tables)
+            result['output'] = output_path
+            return result
+
+        processed = ((table_index, processed_df, True)
+                     for table_index, processed_df in iter_processed_tables(
+                         driver_tables, job_counts, oil_price,
+                         driver_km_totals=driver_km_totals,
+                         km_bonus_paid=km_bonus_paid))
+
+    # Running per-driver summary (fuel_bonus, km_bonus) across tables
+    driver_summaries = None
+    # Aggregation cube of every table (or chunk), for breakdowns
+    cubes = [] if breakdowns or cube_path else None
+    processed_tables = 0
+    writer = None
+    # Before the pipeline starts: the dry run swaps the metrics collector
+    columns = processed_columns(driver_tables, oil_price)
+    store = TripStore(store_path) if store_path else None
+
+    try:
+        # Tables are processed in a background thread while earlier ones
+        # are aggregated, written and stored here
+        for table_index, processed_df, last in pipelined(
+                processed, pipeline_depth, 'vis-process'):
+            result['rows'] += len(processed_df)
+
+            # Calculate totals for each driver and add them to the running summary
+            if 'ชื่อ-นามสกุล' in processed_df.columns:
+                with stage('aggregate', len(processed_df)):
+                    driver_summaries = merge_driver_summaries(
+                        driver_summaries, summarize_drivers(processed_df))
+            if cubes is not None:
+                with stage('aggregate', len(processed_df)):
+                    cubes.append(build_cube(processed_df))
+
+            # Stream the rows (and the table's total row) to the output
+            with stage('write', len(processed_df)):
+                if writer is None:
+                    writer = open_output_writer(output_path, columns, output_format)
+                writer.write_rows(processed_df)
+                if last:
+                    writer.end_table()
+            if last:
+                processed_tables += 1
+
+            if store is not None:
+                store.add_trips(processed_df, oil_price, input_file, table_index)
+                if last:
+                    # Short transactions, other workers may share the store
+                    with stage('store'):
+                        store.commit()
+
+        if processed_tables == 0:
+            logger.warning("No tables were successfully processed")
+            result['status'] = 'no tables'
+            return result
+
+        logger.info("Successfully processed %d tables", processed_tables)
+        logger.info("Saved all driver data to a single sheet 'All_Drivers'")
+
+        # Create driver summary sheet
+        if driver_summaries is not None and not driver_summaries.empty:
+            with stage('write'):
+                writer.write_summary(driver_summary_frame(driver_summaries))
+            logger.info("Saved Driver_Summary")
+        else:
+            logger.info("No driver summaries to report")
+
+        if cubes is not None:
+            with stage('aggregate'):
+                cube = merge_cubes(cubes)
+            del cubes
+            with stage('write'):
+                for sheet_name, sheet in breakdown_sheets(cube, breakdowns or []):
+                    writer.write_sheet(sheet_name, sheet)
+                    logger.info("Saved %s", sheet_name)
+                if cube_path:
+                    save_cube(cube, cube_path)
+                    logger.info("Saved the aggregation cube to %s", cube_path)
+
+        if store is not None:
+            logger.info("Stored %d rows in %s", result['rows'], store_path)
+    finally:
+        if writer is not None:
+            with stage('write'):
+                writer.close()
+        if store is not None:
+            store.close()
+
+    logger.info("Processed data saved to %s", output_path)
+    result['status'] = 'ok'
+    result['tables'] = processed_tables
+    result['output'] = output_path
+    return result
+
+
+def html_to_excel(cache_dir=DEFAULT_CACHE_DIR):
     try:
         # Get oil price from user
         try:
             oil_price = float(input("กรุณาใส่ราคาน้ำมัน: "))
-            print(f"Using oil price: {oil_price} บาท")
+            logger.info("Using oil price: %s บาท", oil_price)
         except ValueError:
-            print("ใส่ราคาน้ำมันไม่ถูกต้อง กำหนดเป็น 30 บาท")
+            logger.warning("ใส่ราคาน้ำมันไม่ถูกต้อง กำหนดเป็น 30 บาท")
             oil_price = 30.0
 
         # Get input file from user
@@ -327,310 +1347,335 @@ def html_to_excel():
             "กรุณาใส่ชื่อไฟล์ที่ต้องการประมวลผล (เช่น vis_job_driver_2025-04-21_14_11_56.xls): ")
         if not input_file:
             input_file = 'vis_job_driver_2025-04-21_14_11_56.xls'
-            print(f"ไม่ได้ระบุชื่อไฟล์ ใช้ไฟล์เริ่มต้น: {input_file}")
+            logger.info("ไม่ได้ระบุชื่อไฟล์ ใช้ไฟล์เริ่มต้น: %s", input_file)
 
-        # Read the HTML file
-        try:
-            with open(input_file, 'r', encoding='utf-8') as file:
-                html_content = file.read()
-                print(f"HTML file '{input_file}' loaded successfully")
-        except Exception as e:
-            print(f"Error reading HTML file: {e}")
-            return
-
-        # Parse HTML with BeautifulSoup
-        soup = BeautifulSoup(html_content, 'html.parser')
+        return process_file(input_file, oil_price, cache_dir=cache_dir)
 
-        # Find all tables in the HTML
-        tables = soup.find_all('table')
-        print(f"Found {len(tables)} tables in the HTML file")
-
-        if len(tables) == 0:
-            print("No tables found in the HTML file")
-            return
-
-        # First, collect all job numbers across all tables to count occurrences
-        all_jobs = []
-        for table in tables:
-            # Find all data rows
-            rows = table.find_all('tr')
-            if len(rows) < 3:  # Need at least header + data row
-                continue
-
-            for tr in rows[2:]:  # Skip the header rows
-                # Check if this is a data row or a summary row
-                if tr.text and 'รวม' not in tr.text:  # Skip summary row
-                    cells = tr.find_all(['td'])
-                    if cells and len(cells) > 2:  # Make sure we have cells
-                        # Assuming job number is in the 3rd column
-                        job_number = cells[2].text.strip() if len(
-                            cells) > 2 else ""
-                        if job_number:
-                            all_jobs.append(job_number)
-
-        # Count occurrences of each job number
-        job_counts = {}
-        for job in all_jobs:
-            if job in job_counts:
-                job_counts[job] = 2  # If it appears more than once, set to 2
-            else:
-                job_counts[job] = 1
-
-        print(f"Collected {len(job_counts)} unique job numbers")
-
-        # Create a writer to save the processed data
-        output_path = "processed_data_with_km_bonus.xlsx"
-        with pd.ExcelWriter(output_path, engine='openpyxl') as writer:
-            # Dictionary to collect driver summaries
-            driver_summaries = {}
-            processed_tables = 0
-
-            # List to store all processed data for the combined sheet
-            all_processed_data = []
-
-            for table_index, table in enumerate(tables):
-                # Extract headers
-                header_rows = table.find_all('tr')
-                if len(header_rows) < 2:
-                    print(
-                        f"Table {table_index} has insufficient rows, skipping")
-                    continue
-
-                header_cells = header_rows[1].find_all('th')
-                if not header_cells:
-                    print(f"Table {table_index} has no header cells, skipping")
-                    continue
-
-                headers = [th.text.strip() for th in header_cells]
-
-                if not headers:
-                    print(f"Table {table_index} has empty headers, skipping")
-                    continue
-
-                print(f"Table {table_index} headers: {headers}")
-
-                # Find all data rows
-                rows = []
-                for tr in table.find_all('tr')[2:]:  # Skip the header rows
-                    # Check if this is a data row or a summary row
-                    if 'รวม' not in tr.text:  # Skip summary row
-                        cells = tr.find_all(['td'])
-                        if cells:  # Make sure we have cells
-                            row_data = [cell.text.strip() for cell in cells]
-                            if len(row_data) == len(headers):  # Ensure row matches headers
-                                rows.append(row_data)
-                            else:
-                                print(
-                                    f"Row length {len(row_data)} doesn't match headers length {len(headers)}, adjusting")
-                                # Adjust row to match headers length
-                                if len(row_data) < len(headers):
-                                    row_data.extend(
-                                        [''] * (len(headers) - len(row_data)))
-                                else:
-                                    row_data = row_data[:len(headers)]
-                                rows.append(row_data)
-
-                if not rows:
-                    print(f"Table {table_index} has no data rows, skipping")
-                    continue
-
-                print(f"Table {table_index} has {len(rows)} data rows")
-
-                # Create DataFrame
-                df = pd.DataFrame(rows, columns=headers)
-
-                # Check if required columns exist for processing (using more flexible column matching)
-                required_base_columns = ['เบอร์รถ', 'กิโลเมตร', 'เลข Job']
-
-                # Check for driver name column with alternative names
-                driver_name_columns = ['ชื่อ-นามสกุล', 'ชื่อ พขร.', 'พขร.']
-                has_driver_name = any(
-                    col in df.columns for col in driver_name_columns)
-
-                missing_base_columns = [
-                    col for col in required_base_columns if col not in df.columns]
-
-                if missing_base_columns or not has_driver_name:
-                    print(
-                        f"Table {table_index} missing required columns: {missing_base_columns}")
-                    if not has_driver_name:
-                        print("Missing driver name column")
-                    print("Skipping this table")
-                    continue
-
-                # Process the data
-                processed_df = process_driver_data(df, job_counts, oil_price)
-                processed_tables += 1
+    except Exception as e:
+        logger.exception("Error: %s", e)
 
-                # Calculate totals for each driver if the required columns exist
-                if 'ชื่อ-นามสกุล' in processed_df.columns:
-                    # Create a DataFrame to store driver totals
-                    driver_totals_df = pd.DataFrame(columns=[
-                                                    'ชื่อ-นามสกุล', 'เบี้ยคำนวณ x ราคาน้ำมัน', 'โบนัสกิโลเมตร', 'รวมโบนัสทั้งหมด'])
-
-                    # Get unique drivers
-                    unique_drivers = processed_df['ชื่อ-นามสกุล'].unique()
-
-                    for driver in unique_drivers:
-                        if pd.notna(driver) and driver != '':
-                            driver_data = processed_df[processed_df['ชื่อ-นามสกุล'] == driver]
-
-                            # Calculate totals
-                            fuel_bonus = driver_data['เบี้ยคำนวณ x ราคาน้ำมัน'].sum(
-                            ) if 'เบี้ยคำนวณ x ราคาน้ำมัน' in driver_data.columns else 0
-                            km_bonus = driver_data['โบนัสกิโลเมตร'].max(
-                            ) if 'โบนัสกิโลเมตร' in driver_data.columns else 0
-                            total_bonus = fuel_bonus + km_bonus
-
-                            # Add to driver summaries
-                            if driver in driver_summaries:
-                                driver_summaries[driver]['fuel_bonus'] += fuel_bonus
-                                # km bonus is fixed per driver
-                                driver_summaries[driver]['km_bonus'] = km_bonus
-                                driver_summaries[driver]['total_bonus'] = driver_summaries[driver]['fuel_bonus'] + \
-                                    driver_summaries[driver]['km_bonus']
-                            else:
-                                driver_summaries[driver] = {
-                                    'fuel_bonus': fuel_bonus,
-                                    'km_bonus': km_bonus,
-                                    'total_bonus': total_bonus
-                                }
-
-                # Add a total row to the dataframe
-                if any(col in processed_df.columns for col in ['เบี้ยคำนวณ', 'เบี้ยคำนวณ x ราคาน้ำมัน', 'โบนัสกิโลเมตร', 'รวมโบนัสทั้งหมด']):
-                    total_row = {'ชื่อ-นามสกุล': ['รวม']}
-
-                    # Add totals for each relevant column
-                    if 'เบี้ยคำนวณ' in processed_df.columns:
-                        total_row['เบี้ยคำนวณ'] = [
-                            processed_df['เบี้ยคำนวณ'].sum()]
-
-                    if 'เบี้ยคำนวณ x ราคาน้ำมัน' in processed_df.columns:
-                        total_row['เบี้ยคำนวณ x ราคาน้ำมัน'] = [
-                            processed_df['เบี้ยคำนวณ x ราคาน้ำมัน'].sum()]
-
-                    if 'โบนัสกิโลเมตร' in processed_df.columns:
-                        total_row['โบนัสกิโลเมตร'] = [
-                            processed_df['โบนัสกิโลเมตร'].sum()]
-
-                    if 'รวมโบนัสทั้งหมด' in processed_df.columns:
-                        total_row['รวมโบนัสทั้งหมด'] = [
-                            processed_df['รวมโบนัสทั้งหมด'].sum()]
-
-                    total_row_df = pd.DataFrame(total_row)
-
-                    # Add columns that are in processed_df but not in total_row_df
-                    for col in processed_df.columns:
-                        if col not in total_row_df.columns:
-                            total_row_df[col] = ['']
-
-                    # Make sure columns are in the same order
-                    total_row_df = total_row_df[processed_df.columns]
-
-                    # Concatenate processed_df and total_row_df
-                    processed_df = pd.concat(
-                        [processed_df, total_row_df], ignore_index=True)
-
-                # Add a separator row for visual clarity in the combined sheet
-                separator_row = pd.DataFrame(
-                    [['']*len(processed_df.columns)], columns=processed_df.columns)
-
-                # Add the processed data to our list for the combined sheet
-                all_processed_data.append(processed_df)
-                # Add separator after each table
-                all_processed_data.append(separator_row)
-
-            if processed_tables == 0:
-                print("No tables were successfully processed")
-                return
-
-            print(f"Successfully processed {processed_tables} tables")
-
-            # Create and save the combined sheet with all driver data
-            if all_processed_data:
-                # Remove the last separator as it's not needed
-                all_processed_data.pop()
-
-                # Combine all data into a single dataframe
-                combined_df = pd.concat(all_processed_data, ignore_index=True)
-
-                # Add a grand total row at the end
-                grand_total_columns = [
-                    'เบี้ยคำนวณ', 'เบี้ยคำนวณ x ราคาน้ำมัน', 'โบนัสกิโลเมตร', 'รวมโบนัสทั้งหมด']
-                grand_total_row = {'ชื่อ-นามสกุล': ['รวมทั้งหมด']}
-
-                for col in grand_total_columns:
-                    if col in combined_df.columns:
-                        # Calculate sums excluding the separator rows (which have empty values)
-                        col_sum = combined_df[col].replace(
-                            '', np.nan).dropna().sum()
-                        grand_total_row[col] = [col_sum]
-
-                grand_total_df = pd.DataFrame(grand_total_row)
-
-                # Add columns that are in combined_df but not in grand_total
-                # Add columns that are in combined_df but not in grand_total_df
-                for col in combined_df.columns:
-                    if col not in grand_total_df.columns:
-                        grand_total_df[col] = ['']
-
-                # Make sure columns are in the same order
-                grand_total_df = grand_total_df[combined_df.columns]
-
-                # Concatenate with the combined_df
-                combined_df = pd.concat(
-                    [combined_df, grand_total_df], ignore_index=True)
-
-                # Save the combined data to a single sheet
-                combined_df.to_excel(
-                    writer, sheet_name="All_Drivers", index=False)
-                print(f"Saved all driver data to a single sheet 'All_Drivers'")
-
-            # Create driver summary sheet
-            if driver_summaries:
-                summary_data = {
-                    'ชื่อ-นามสกุล': [],
-                    'เบี้ยประหยัดน้ำมัน': [],
-                    'โบนัสกิโลเมตร': [],
-                    'รวมโบนัสทั้งหมด': []
-                }
-
-                for driver, bonuses in driver_summaries.items():
-                    summary_data['ชื่อ-นามสกุล'].append(driver)
-                    summary_data['เบี้ยประหยัดน้ำมัน'].append(
-                        bonuses['fuel_bonus'])
-                    summary_data['โบนัสกิโลเมตร'].append(bonuses['km_bonus'])
-                    summary_data['รวมโบนัสทั้งหมด'].append(
-                        bonuses['total_bonus'])
-
-                    summary_df = pd.DataFrame(summary_data)
-
-                # Calculate totals
-                summary_totals = {
-                    'ชื่อ-นามสกุล': 'รวมทั้งหมด',
-                    'เบี้ยประหยัดน้ำมัน': summary_df['เบี้ยประหยัดน้ำมัน'].sum(),
-                    'โบนัสกิโลเมตร': summary_df['โบนัสกิโลเมตร'].sum(),
-                    'รวมโบนัสทั้งหมด': summary_df['รวมโบนัสทั้งหมด'].sum()
-                }
-
-                # Add total row to summary
-                summary_df = pd.concat(
-                    [summary_df, pd.DataFrame([summary_totals])], ignore_index=True)
-
-                # Save summary to Excel
-                summary_df.to_excel(
-                    writer, sheet_name="Driver_Summary", index=False)
-                print("Saved Driver_Summary to Excel")
-            else:
-                print("No driver summaries to report")
 
-        print(f"Processed data saved to {output_path}")
+def find_input_files(patterns):
+    """
+    Expand input globs and directories into a sorted, de-duplicated list of
+    files. Directories contribute their *.xls, *.xlsx, *.html and *.htm files.
+    """
+    files = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for extension in ('*.xls', '*.xlsx', '*.html', '*.htm'):
+                files.extend(glob.glob(os.path.join(pattern, extension)))
+        else:
+            matches = glob.glob(pattern, recursive=True)
+            files.extend(matches if matches else [pattern])
+    return sorted(dict.fromkeys(os.path.abspath(f) for f in files))
+
+
+def output_path_for(input_file, output_dir, used_paths, output_format='xlsx',
+                    kind='processed'):
+    """Pick <output_dir>/<input name>_<kind>.<format>, avoiding name clashes"""
+    stem = os.path.splitext(os.path.basename(input_file))[0]
+    output_path = os.path.join(output_dir, f"{stem}_{kind}.{output_format}")
+    suffix = 2
+    while output_path in used_paths:
+        output_path = os.path.join(
+            output_dir, f"{stem}_{kind}_{suffix}.{output_format}")
+        suffix += 1
+    used_paths.add(output_path)
+    return output_path
+
+
+def scan_file(input_file, cache_dir=None,
+              cache_max_bytes=DEFAULT_CACHE_MAX_BYTES, chunk_rows=None):
+    """
+    Per-driver km totals and job_crews() over every processable table of
+    one export, from a single read of it
+    """
+    try:
+        with quiet_logs():
+            if chunk_rows:
+                _, km_totals, _, crews = scan_table_chunks(input_file, chunk_rows)
+                return km_totals, crews
+            tables = read_tables(input_file, cache_dir, cache_max_bytes)[0]
+            driver_tables = build_driver_tables(tables)
+        return (merge_km_totals(table_driver_km_totals(df) for _, df in driver_tables),
+                merge_job_crews(job_crews(df) for _, df in driver_tables))
+    except Exception:
+        # The file is reported as an error when it is processed
+        return pd.Series(dtype=object), pd.DataFrame(columns=['job', 'driver'])
+
+
+def _run_in_pool(func, jobs, workers, log_level=logging.WARNING, row_debug=False):
+    """
+    Run func(**job) for every job, across a process pool when workers > 1.
+    Worker processes log at log_level.
+    Returns the results in job order, with the exception for failed jobs.
+    """
+    if workers == 1:
+        results = []
+        for job in jobs:
+            try:
+                results.append(func(**job))
+            except Exception as e:
+                results.append(e)
+        return results
+
+    # Imported here, multiprocessing adds to the start-up of every run
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=configure_logging,
+                             initargs=(log_level, row_debug)) as executor:
+        futures = [executor.submit(func, **job) for job in jobs]
+        results = []
+        for future in futures:
+            try:
+                results.append(future.result())
+            except Exception as e:
+                results.append(e)
+        return results
+
+
+def run_batch(input_files, oil_price, output_dir, workers=None,
+              km_across_files=False, output_format='xlsx', cache_dir=None,
+              cache_max_bytes=DEFAULT_CACHE_MAX_BYTES, scenarios=None,
+              chunk_rows=None, store_path=None, pipeline_depth=PIPELINE_DEPTH,
+              job_registry=None, breakdowns=None, cube=False):
+    """
+    Process many VIS exports, fanning the files out across a process pool
+    whose workers log at the level of the 'vis' logger.
+    With km_across_files, KM bonuses use driver km totals over all files and
+    each driver's bonus is paid in the first file they appear in. With
+    job_registry the crews of every file are registered first, and with cube
+    every file's cube is saved as <name>_cube.pkl in output_dir. The other
+    options are passed on to process_file.
+    Returns the status dicts in input order.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    workers = max(1, min(workers or os.cpu_count() or 1, len(input_files)))
+    log_level = logger.getEffectiveLevel()
+    row_debug = row_logger.isEnabledFor(logging.DEBUG)
+
+    km_state = [(None, None)] * len(input_files)
+    if km_across_files or job_registry:
+        # One read of every file for both the km totals and the job crews
+        scans = _run_in_pool(
+            scan_file,
+            [dict(input_file=f, cache_dir=cache_dir, cache_max_bytes=cache_max_bytes,
+                  chunk_rows=chunk_rows) for f in input_files],
+            workers, log_level, row_debug)
+        scans = [(pd.Series(dtype=object), pd.DataFrame(columns=['job', 'driver']))
+                 if isinstance(scan, Exception) else scan for scan in scans]
+
+    if km_across_files:
+        driver_km_totals = merge_km_totals(totals for totals, _ in scans)
+        km_state = []
+        seen_drivers = set()
+        for totals, _ in scans:
+            km_state.append((driver_km_totals, set(seen_drivers)))
+            seen_drivers.update(totals.index)
+
+    if job_registry:
+        with TripStore(job_registry) as registry:
+            registry.add_crews(merge_job_crews(crews for _, crews in scans))
+
+    used_paths = set()
+    kind = 'scenarios' if scenarios else 'processed'
+    cube_paths = set()
+    options = dict(oil_price=oil_price, output_format=output_format,
+                   cache_dir=cache_dir, cache_max_bytes=cache_max_bytes,
+                   scenarios=scenarios, chunk_rows=chunk_rows,
+                   store_path=store_path, pipeline_depth=pipeline_depth,
+                   job_registry=job_registry, breakdowns=breakdowns)
+    jobs = [dict(options, input_file=f,
+                 output_path=output_path_for(f, output_dir, used_paths, output_format, kind),
+                 driver_km_totals=driver_km_totals, km_bonus_paid=km_bonus_paid,
+                 cube_path=(output_path_for(f, output_dir, cube_paths, 'pkl', 'cube')
+                            if cube else None))
+            for f, (driver_km_totals, km_bonus_paid) in zip(input_files, km_state)]
+
+    results = []
+    for job, result in zip(jobs, _run_in_pool(process_file, jobs, workers,
+                                              log_level, row_debug)):
+        if isinstance(result, Exception):
+            result = {'file': job['input_file'], 'status': 'error', 'tables': 0,
+                      'rows': 0, 'seconds': 0.0, 'output': None,
+                      'error': str(result), 'metrics': {}}
+        results.append(result)
+    return results
+
+
+def print_batch_report(results, wall_seconds):
+    """Print a per-file status/timing table for a batch run"""
+    print()
+    print(f"{'status':<10} {'tables':>6} {'rows':>9} {'seconds':>8}  file")
+    for result in results:
+        print(f"{result['status']:<10} {result['tables']:>6} {result['rows']:>9} "
+              f"{result['seconds']:>8.2f}  {result['file']}")
+        if result['status'] == 'error':
+            print(f"{'':<10} error: {result['error']}")
+    failed = sum(1 for result in results if result['status'] != 'ok')
+    total_seconds = sum(result['seconds'] for result in results)
+    print(f"{len(results)} files, {failed} not ok, "
+          f"{total_seconds:.2f}s processing in {wall_seconds:.2f}s wall time")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Calculate fuel and KM bonuses from VIS HTML exports. "
+                    "Run without arguments for interactive mode.")
+    parser.add_argument('inputs', nargs='*',
+                        help="input files, globs or directories")
+    parser.add_argument('-p', '--oil-price', type=float,
+                        help="oil price in baht (required for batch mode)")
+    parser.add_argument('-o', '--output-dir', default='.',
+                        help="directory for the processed workbooks")
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help="number of worker processes (default: CPU count)")
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help="show progress output for every file (--log-level info)")
+    parser.add_argument('--log-level', choices=['debug', 'info', 'warning', 'error'],
+                        help="log level (default: info in interactive mode, "
+                             "warning in batch mode)")
+    parser.add_argument('--debug-rows', action='store_true',
+                        help="log per-row bonus calculations (slow on big files)")
+    parser.add_argument('--report', metavar='PATH',
+                        help="write a JSON run report with per-stage timings")
+    parser.add_argument('-f', '--format', choices=OUTPUT_FORMATS, default='xlsx',
+                        help="output format: xlsx workbook, or csv/parquet data files")
+    parser.add_argument('--km-across-files', action='store_true',
+                        help="calculate KM bonuses from driver totals over all input files")
+    parser.add_argument('--scenario-oil-prices', metavar='PRICES',
+                        help="scenario mode: comma-separated oil prices to compare, "
+                             "e.g. 29,30,31,32 (writes <name>_scenarios files)")
+    parser.add_argument('--scenario-rates', metavar='PATH', action='append', default=[],
+                        help="scenario mode: compare against another rate table file "
+                             "(repeatable)")
+    parser.add_argument('--rate-override', metavar='SPEC', action='append', default=[],
+                        help="scenario mode: compare against the rate table with "
+                             "CAR_TYPE[:CATEGORY][:old|new]=RATE changes, e.g. "
+                             "flatbed=6.2 (comma-separated, repeatable)")
+    parser.add_argument('--chunk-rows', type=int, nargs='?', const=CHUNK_ROWS,
+                        metavar='N',
+                        help="process tables N rows at a time (default N: "
+                             f"{CHUNK_ROWS}) for exports too big for memory; "
+                             "reads each file twice and skips the parse cache")
+    parser.add_argument('--pipeline-depth', type=int, default=PIPELINE_DEPTH, metavar='N',
+                        help="tables/chunks a parse or processing stage may run ahead "
+                             "of the next (default: %(default)s, 0: no pipelining)")
+    parser.add_argument('--store', nargs='?', const=DEFAULT_STORE_PATH, metavar='PATH',
+                        help="also upsert the processed rows into a SQLite trip store "
+                             f"(default PATH: {DEFAULT_STORE_PATH}), "
+                             "query it with vis_store.py")
+    parser.add_argument('--job-registry', nargs='?', const=DEFAULT_STORE_PATH,
+                        metavar='PATH',
+                        help="count drivers of a job over every export ingested so far, "
+                             "kept in a trip store file (default PATH: the --store default)")
+    parser.add_argument('--breakdown', metavar='NAMES',
+                        help="add breakdown sheets cut from an aggregation cube: "
+                             "comma-separated " + ', '.join(BREAKDOWNS) + " or all")
+    parser.add_argument('--cube', action='store_true',
+                        help="save each file's aggregation cube as <name>_cube.pkl, "
+                             "to merge across files or months with vis_cube.py")
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR,
+                        help="parse cache directory (default: %(default)s)")
+    parser.add_argument('--cache-size', type=int,
+                        default=DEFAULT_CACHE_MAX_BYTES >> 20,
+                        help="parse cache size limit in MB (default: %(default)s)")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="always parse the input files, without the parse cache")
+    parser.add_argument('--invalidate-cache', action='store_true',
+                        help="drop cached parse results of the input files "
+                             "(of all files when no inputs are given)")
+    args = parser.parse_args(argv)
+    cache_dir = None if args.no_cache else args.cache_dir
+
+    if args.log_level:
+        log_level = getattr(logging, args.log_level.upper())
+    elif args.verbose or not args.inputs:
+        log_level = logging.INFO
+    else:
+        log_level = logging.WARNING
+    configure_logging(log_level, args.debug_rows)
+
+    if args.invalidate_cache:
+        if args.inputs:
+            removed = sum(invalidate(args.cache_dir, f)
+                          for f in find_input_files(args.inputs)
+                          if os.path.isfile(f))
+        else:
+            removed = invalidate(args.cache_dir)
+        print(f"Removed {removed} parse cache entries")
+        if args.oil_price is None:
+            return 0
+
+    if not args.inputs:
+        started = time.perf_counter()
+        result = html_to_excel(cache_dir)
+        if args.report and result is not None:
+            metrics = RunMetrics()
+            metrics.merge(result['metrics'])
+            write_run_report(args.report, [result], metrics,
+                             time.perf_counter() - started)
+        return 0
 
-    except Exception as e:
-        import traceback
-        print(f"Error: {e}")
-        print(traceback.format_exc())
+    scenarios = None
+    if args.scenario_oil_prices or args.scenario_rates or args.rate_override:
+        try:
+            oil_prices = ([float(price) for price in args.scenario_oil_prices.split(',')]
+                          if args.scenario_oil_prices else [args.oil_price])
+            if None in oil_prices:
+                parser.error("scenario mode needs --scenario-oil-prices or --oil-price")
+            base_rates = load_rate_table()
+            rate_tables = [(base_rates.version, base_rates)]
+            rate_tables += [(os.path.splitext(os.path.basename(path))[0],
+                             load_rate_table(path)) for path in args.scenario_rates]
+            rate_tables += [(spec, override_rates(base_rates, spec))
+                            for spec in args.rate_override]
+        except (OSError, ValueError) as e:
+            parser.error(f"invalid scenario: {e}")
+        scenarios = build_scenarios(oil_prices, rate_tables)
+        if args.chunk_rows:
+            parser.error("--chunk-rows cannot be combined with scenario mode")
+        if args.store:
+            parser.error("--store cannot be combined with scenario mode")
+        if args.breakdown or args.cube:
+            parser.error("--breakdown and --cube cannot be combined with scenario mode")
+    elif args.oil_price is None:
+        parser.error("--oil-price is required when input files are given")
+
+    breakdowns = None
+    if args.breakdown:
+        try:
+            breakdowns = parse_breakdowns(args.breakdown)
+        except ValueError as e:
+            parser.error(str(e))
+
+    input_files = find_input_files(args.inputs)
+    missing = [f for f in input_files if not os.path.isfile(f)]
+    if missing:
+        parser.error(f"input file not found: {', '.join(missing)}")
+
+    started = time.perf_counter()
+    results = run_batch(input_files, args.oil_price, args.output_dir,
+                        workers=args.workers,
+                        km_across_files=args.km_across_files,
+                        output_format=args.format, cache_dir=cache_dir,
+                        cache_max_bytes=args.cache_size << 20,
+                        scenarios=scenarios, chunk_rows=args.chunk_rows,
+                        store_path=args.store, pipeline_depth=args.pipeline_depth,
+                        job_registry=args.job_registry,
+                        breakdowns=breakdowns, cube=args.cube)
+    wall_seconds = time.perf_counter() - started
+    print_batch_report(results, wall_seconds)
+
+    metrics = RunMetrics()
+    for result in results:
+        metrics.merge(result['metrics'])
+    metrics.log_summary()
+    if args.report:
+        write_run_report(args.report, results, metrics, wall_seconds)
+    return 0 if all(result['status'] == 'ok' for result in results) else 1
 
 
 if __name__ == "__main__":
-    html_to_excel()
+    sys.exit(main())
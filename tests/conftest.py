@@ -0,0 +1,17 @@
+import os
+import sys
+
+import pytest
+
+# The modules live at the repository root
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+
+@pytest.fixture(scope='session')
+def vis_export(tmp_path_factory):
+    """A small synthetic VIS export (see benchmarks/generate_vis_export.py)"""
+    from generate_vis_export import generate_export
+    return generate_export(str(tmp_path_factory.mktemp('exports') / 'vis_3k.xls'),
+                           rows=3000, rows_per_table=700, drivers=40)
@@ -0,0 +1,48 @@
+import pandas as pd
+import pytest
+
+from vis_cube import DIMENSIONS, breakdown_frame, build_cube, load_cube, merge_cubes, save_cube
+
+
+def _processed(rows):
+    return pd.DataFrame(rows, columns=['ชื่อ-นามสกุล', 'เบอร์รถ', 'ประเภทรถ', 'ประเภทระยะทาง',
+                                       'ต้นทาง', 'กิโลเมตร', 'น้ำมัน(ลิตร)',
+                                       'เบี้ยคำนวณ x ราคาน้ำมัน', 'โบนัสกิโลเมตร'])
+
+
+TABLES = [
+    _processed([['นาย ก', '150', 'full_23m', 'ไกล', 'BKK', 900.0, 200.0, 12.5, 1500],
+                ['นาย ข', '151', 'flatbed', 'ใกล้', None, 100.0, 20.0, -3.0, 0]]),
+    # Compacted like process_driver_data output (see vis_schema)
+    _processed([['นาย ก', '150', 'full_23m', 'ไกล', 'LCB', 850.0, 190.0, 8.0, 0],
+                ['นาย ค', '150', 'full_23m', 'ใกล้', 'BKK', 50.0, 10.0, 1.5, 0]]
+               ).astype({column: 'category' for column in DIMENSIONS}),
+]
+
+
+def test_breakdown_matches_a_groupby_over_the_rows():
+    cube = merge_cubes(build_cube(table) for table in TABLES)
+    sheet = breakdown_frame(cube, 'เบอร์รถ')
+    assert sheet['เบอร์รถ'].tolist() == ['150', '151', 'รวมทั้งหมด']
+    assert sheet['จำนวนเที่ยว'].tolist() == [3, 1, 4]
+    assert sheet['กิโลเมตร'].tolist() == [1800.0, 100.0, 1900.0]
+    assert sheet['รวมโบนัสทั้งหมด'].tolist() == [1522.0, -3.0, 1519.0]
+
+    sources = breakdown_frame(cube, 'ต้นทาง')
+    assert sources['ต้นทาง'].tolist() == ['', 'BKK', 'LCB', 'รวมทั้งหมด']
+
+
+def test_merge_order_and_saved_cubes(tmp_path):
+    cubes = [build_cube(table) for table in TABLES]
+    path = str(tmp_path / 'month_cube.pkl')
+    save_cube(cubes[0], path)
+    forward = breakdown_frame(merge_cubes([load_cube(path), cubes[1]]), 'ชื่อ-นามสกุล')
+    backward = breakdown_frame(merge_cubes(cubes[::-1]), 'ชื่อ-นามสกุล')
+    pd.testing.assert_frame_equal(forward, backward)
+
+
+def test_refuses_other_cube_versions(tmp_path):
+    path = tmp_path / 'old_cube.pkl'
+    path.write_bytes(__import__('pickle').dumps((1, None)))
+    with pytest.raises(ValueError, match='version'):
+        load_cube(str(path))
@@ -0,0 +1,89 @@
+"""
+The fast paths against the code they replaced: the vectorized bonus against
+calculate_bonus per row, chunked against whole-file processing, and the lxml
+parser against html.parser.
+"""
+import filecmp
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from html_format import (CAR_TYPES, calculate_bonus, calculate_bonus_vectorized,
+                         load_rate_table, process_file, rate_table_rows)
+from vis_cache import parse_tables
+
+
+def _reference_bonus(row, rows):
+    try:
+        return calculate_bonus(row, rows)
+    except ValueError:
+        # A blank rate table cell; the vectorized engine gives 0, as for a
+        # rate calculate_bonus cannot find
+        return 0.0
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_vectorized_bonus_matches_calculate_bonus(seed):
+    rng = np.random.default_rng(seed)
+    rate_table = load_rate_table()
+    n = 2000
+    df = pd.DataFrame({
+        'ประเภทรถ': rng.choice(CAR_TYPES, n),
+        'ประเภทระยะทาง': rng.choice(list(rate_table.categories) + ['ไม่มีในตาราง'], n),
+        'กิโลเมตร': np.where(rng.random(n) < 0.1, 0.0, rng.uniform(1, 1500, n).round(1)),
+        'เรท': np.where(rng.random(n) < 0.1, 0.0, rng.uniform(2.5, 9, n).round(2)),
+    })
+    rows = rate_table_rows(rate_table)
+    expected = np.array([_reference_bonus(row, rows) for _, row in df.iterrows()])
+    np.testing.assert_allclose(calculate_bonus_vectorized(df, rate_table), expected,
+                               rtol=1e-12, atol=1e-9)
+
+
+@pytest.fixture(scope='module')
+def small_export(tmp_path_factory):
+    """Few rows, so that chunks of one or two rows hold all-blank or
+    all-integer numeric columns"""
+    from generate_vis_export import generate_export
+    return generate_export(str(tmp_path_factory.mktemp('exports') / 'vis_60.xls'),
+                           rows=60, rows_per_table=25, drivers=8)
+
+
+@pytest.mark.parametrize('export, chunk_rows', [('vis_export', 250),
+                                                ('small_export', 1),
+                                                ('small_export', 2)])
+def test_chunked_output_matches_whole_file(export, chunk_rows, request, tmp_path):
+    input_file = request.getfixturevalue(export)
+    outputs = {}
+    for name, rows in [('whole', None), ('chunked', chunk_rows)]:
+        output_path = str(tmp_path / f'{name}.csv')
+        result = process_file(input_file, 31.5, output_path, output_format='csv',
+                              chunk_rows=rows)
+        assert result['status'] == 'ok', result['error']
+        outputs[name] = output_path
+    for suffix in ['', '_summary']:
+        whole, chunked = (os.path.splitext(outputs[name])[0] + suffix + '.csv'
+                          for name in ('whole', 'chunked'))
+        assert filecmp.cmp(whole, chunked, shallow=False)
+
+
+def _tables(input_file, html_parser):
+    tables, job_counts = parse_tables(input_file, html_parser=html_parser)
+    return [(index, headers, rows if isinstance(rows, list) else rows.values.tolist())
+            for index, headers, rows in tables], job_counts
+
+
+def test_lxml_and_html_parser_give_the_same_tables(vis_export, tmp_path):
+    pytest.importorskip('lxml')
+    messy = tmp_path / 'messy.xls'
+    messy.write_text(
+        '<html><body><table><tr><th colspan="3">ชุดที่ 1</th></tr>'
+        '<tr><th>ลำดับ</th><th> ชื่อ  พขร. </th><th>เลข Job</th></tr>'
+        '<tr><td>1</td><td><b>นาย</b> ก&nbsp;<br>ข</td><td>J&amp;1</td></tr>'
+        '<tr><td>2<td>นาย ค<td>J2</tr>'
+        '<tr><td colspan="2">รวม</td><td></td></tr>'
+        '</table><table><tr><td>ว่าง</td></tr></table></body></html>',
+        encoding='utf-8')
+    for input_file in (vis_export, str(messy)):
+        assert _tables(input_file, 'lxml') == _tables(input_file, 'html.parser')
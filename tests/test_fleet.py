@@ -0,0 +1,25 @@
+import pandas as pd
+
+from html_format import assign_car_types, compile_fleet_registry
+
+FLEET = compile_fleet_registry(
+    b"car_number,car_type,effective_from,effective_to\n"
+    b"150,full_23m,,\n"
+    b"150,flatbed,2025-04-10,2025-04-20\n")
+
+
+def test_date_effective_override_with_iso_and_vis_dates():
+    cars = pd.Series(['150'] * 5 + ['999'])
+    dates = pd.Series(['2025-04-01', '01/04/2025', '2025-04-12', '12/04/2025',
+                       '04/12/2025', '2025-04-12'])
+    car_types = assign_car_types(cars, dates, FLEET)
+    assert car_types.tolist() == ['full_23m', 'full_23m', 'flatbed', 'flatbed',
+                                  'full_23m', 'unknown']
+
+
+def test_override_end_date_is_inclusive_for_timestamped_trips():
+    cars = pd.Series(['150'] * 4)
+    dates = pd.Series(['20/04/2025', '20/04/2025 08:30:00', '2025-04-20T23:59:59',
+                       '21/04/2025 00:00:00'])
+    car_types = assign_car_types(cars, dates, FLEET)
+    assert car_types.tolist() == ['flatbed', 'flatbed', 'flatbed', 'full_23m']
@@ -0,0 +1,51 @@
+import pandas as pd
+
+from html_format import process_html, run_batch
+
+HEADERS = ['ลำดับ', 'วันที่', 'เลข Job', 'เบอร์รถ', 'ชื่อ พขร.', 'ต้นทาง', 'ปลายทาง',
+           'กิโลเมตร', 'น้ำมัน(ลิตร)', 'เรท']
+
+# In driver_km_bonuses with a 1500 bonus above 5000 km
+DRIVER = 'นาย วิชิต เรืองชาญ'
+OTHER = 'นาย สมชาย ใจดี'
+
+
+def _export(*tables):
+    """VIS HTML with one <table> per list of (job, driver, km) rows"""
+    parts = ['<html><body>']
+    for rows in tables:
+        parts.append('<table><tr><th colspan="10">ชุดที่ 1</th></tr><tr>'
+                     + ''.join(f'<th>{h}</th>' for h in HEADERS) + '</tr>')
+        for i, (job, driver, km) in enumerate(rows):
+            cells = [i + 1, '16/04/2025', job, '150', driver, 'BKK', 'LCB',
+                     f'{km:,.1f}', f'{km / 4:,.2f}', '4.00']
+            parts.append('<tr>' + ''.join(f'<td>{c}</td>' for c in cells) + '</tr>')
+        parts.append('</table>')
+    parts.append('</body></html>')
+    return ''.join(parts)
+
+
+def _bonuses(df, driver):
+    return df.loc[df['ชื่อ-นามสกุล'] == driver, 'โบนัสกิโลเมตร'].tolist()
+
+
+def test_km_bonus_paid_once_over_tables():
+    # 3000 + 2500 km: neither table alone is over 5000 km
+    html = _export([('J1', OTHER, 100.0), ('J2', DRIVER, 1500.0), ('J3', DRIVER, 1500.0)],
+                   [('J4', 'นาย  วิชิต&nbsp;เรืองชาญ', 2500.0)])
+    combined_df, _ = process_html(html, 31.5)
+    assert _bonuses(combined_df, DRIVER) == [1500, 0, 0]
+    assert _bonuses(combined_df, OTHER) == [0]
+
+
+def test_km_bonus_paid_once_over_files(tmp_path):
+    first, second = tmp_path / 'a.xls', tmp_path / 'b.xls'
+    first.write_text(_export([('J1', DRIVER, 3000.0)]), encoding='utf-8')
+    # Over 5000 km on its own too, but paid in the first file already
+    second.write_text(_export([('J2', DRIVER, 3000.0), ('J3', DRIVER, 2500.0)]),
+                      encoding='utf-8')
+    results = run_batch([str(first), str(second)], 31.5, str(tmp_path / 'out'),
+                        workers=1, km_across_files=True, output_format='csv')
+    assert [result['status'] for result in results] == ['ok', 'ok']
+    bonuses = [_bonuses(pd.read_csv(result['output']), DRIVER) for result in results]
+    assert bonuses == [[1500], [0, 0]]
@@ -0,0 +1,44 @@
+import pandas as pd
+import pytest
+
+from html_format import (normalize_driver_name, normalize_driver_names,
+                         special_source_mask, special_source_pattern,
+                         zero_calculation_sources)
+
+VARIANTS = [
+    'นาย วิชิต เรืองชาญ',
+    'นาย  วิชิต   เรืองชาญ',
+    ' นาย วิชิต เรืองชาญ\n',
+    'นาย\tวิชิต\xa0เรืองชาญ',
+    'นาย\u3000วิชิต เรืองชาญ',
+    'นาย วิ\u200bชิต เรือง\u200cชาญ\u200d',
+    '\ufeffนาย\u2060 วิชิต เรืองชาญ',
+]
+
+
+@pytest.mark.parametrize('dtype', [object, 'str'])
+def test_whitespace_and_zero_width_variants_give_one_name(dtype):
+    names = pd.Series(VARIANTS, dtype=dtype)
+    assert normalize_driver_names(names).tolist() == ['นาย วิชิต เรืองชาญ'] * len(VARIANTS)
+    assert [normalize_driver_name(name) for name in VARIANTS] == ['นาย วิชิต เรืองชาญ'] * len(VARIANTS)
+
+
+def test_prefix_variants_keep_the_prefix_and_stay_distinct():
+    names = pd.Series(['นาย วิชิต', 'นาย  วิชิต', 'นาง วิชิต', 'นายวิชิต', None, ''],
+                      dtype=object)
+    normalized = normalize_driver_names(names)
+    assert normalized[:4].tolist() == ['นาย วิชิต', 'นาย วิชิต', 'นาง วิชิต', 'นายวิชิต']
+    assert pd.isna(normalized[4]) and normalized[5] == ''
+
+
+def test_special_sources_match_case_insensitive_substrings():
+    sources = pd.Series(['คลัง รถซ่อม บางนา', 'aat toy', 'FTM Toy 2', 'ลาดกระบัง',
+                         None, 'รถซ่อม', 'AAT'], dtype=object)
+    expected = [True, True, True, False, False, True, False]
+    assert special_source_mask(sources).tolist() == expected
+    assert special_source_mask(sources.astype('category')).tolist() == expected
+
+
+def test_special_source_pattern_is_compiled_once():
+    sources = tuple(zero_calculation_sources)
+    assert special_source_pattern(sources) is special_source_pattern(sources)
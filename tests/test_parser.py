@@ -0,0 +1,39 @@
+import datetime
+
+import pytest
+
+from vis_parser import HTML_PARSERS, iter_html_tables, iter_vis_tables
+
+HEADERS = ['ลำดับ', 'วันที่', 'เลข Job', 'เบอร์รถ', 'ชื่อ พขร.', 'กิโลเมตร']
+
+
+def _workbook(path, rows):
+    openpyxl = pytest.importorskip('openpyxl')
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.append(['รายงาน'])
+    sheet.append(HEADERS)
+    for row in rows:
+        sheet.append(row)
+    workbook.save(path)
+
+
+def test_workbook_dates_are_read_like_the_html_export(tmp_path):
+    path = str(tmp_path / 'export.xlsx')
+    _workbook(path, [
+        [1, datetime.datetime(2025, 4, 1), 'J1', 150, 'นาย ก', 400.0],
+        [2, datetime.datetime(2025, 4, 16, 8, 30), 'J2', 150, 'นาย ก', 120.5],
+    ])
+    (_, headers, rows, job_counts), = iter_vis_tables(path)
+    assert headers[1] == 'วันที่' and headers[4] == 'ชื่อ-นามสกุล'
+    assert [row[1] for row in rows] == ['01/04/2025', '16/04/2025 08:30:00']
+    assert [row[5] for row in rows] == ['400', '120.5']
+    assert job_counts == {'J1': 1, 'J2': 1}
+
+
+@pytest.mark.parametrize('html_parser', sorted(HTML_PARSERS))
+@pytest.mark.parametrize('document', ['', b'', '  \n ', '<html></html>'])
+def test_documents_without_tables(html_parser, document):
+    if html_parser == 'lxml':
+        pytest.importorskip('lxml')
+    assert list(iter_html_tables(document, html_parser=html_parser)) == []
@@ -0,0 +1,75 @@
+import pandas as pd
+import pytest
+
+from html_format import job_crews, registry_job_counts
+from vis_store import TripStore, trip_periods
+
+
+def _processed(rows):
+    return pd.DataFrame(rows, columns=['เลข Job', 'ชื่อ-นามสกุล', 'วันที่', 'เบอร์รถ',
+                                       'กิโลเมตร', 'เบี้ยคำนวณ x ราคาน้ำมัน',
+                                       'โบนัสกิโลเมตร'])
+
+
+@pytest.fixture
+def store(tmp_path):
+    with TripStore(str(tmp_path / 'trips.sqlite')) as store:
+        store.add_trips(_processed([
+            ['J1', 'นาย ก', '16/04/2025', '150', 400.0, 10.0, 0.0],
+            ['J1', 'นาย ข', '16/04/2025', '150', 400.0, 10.0, 0.0],
+            ['J2', 'นาย ก', '02/05/2025', '151', 900.0, -5.0, 1500.0],
+        ]), 31.5, 'export.xls', 0)
+        store.commit()
+        yield store
+
+
+def test_trips_without_filter(store):
+    trips = store.trips()
+    assert len(trips) == 3
+    assert trips['period'].tolist() == ['2025-04', '2025-04', '2025-05']
+
+
+@pytest.mark.parametrize('filters, expected', [
+    ({'driver': 'นาย ก'}, [('J1', 'นาย ก'), ('J2', 'นาย ก')]),
+    ({'car_number': '151'}, [('J2', 'นาย ก')]),
+    ({'job': 'J1'}, [('J1', 'นาย ก'), ('J1', 'นาย ข')]),
+    ({'start': '2025-05'}, [('J2', 'นาย ก')]),
+    ({'end': '2025-04'}, [('J1', 'นาย ก'), ('J1', 'นาย ข')]),
+    ({'driver': 'นาย ข', 'start': '2025-05'}, []),
+])
+def test_trips_filters(store, filters, expected):
+    trips = store.trips(**filters)
+    assert list(zip(trips['job'], trips['driver'])) == expected
+
+
+def test_trip_periods_iso_and_vis_dates():
+    dates = pd.Series(['2025-04-01', '01/04/2025', '16/04/2025', '2025-12-03',
+                       'x', None, '2025-04-01'], dtype=object)
+    periods, iso_dates = trip_periods(dates)
+    assert periods == ['2025-04', '2025-04', '2025-04', '2025-12', None, None, '2025-04']
+    assert iso_dates == ['2025-04-01', '2025-04-01', '2025-04-16', '2025-12-03',
+                         None, None, '2025-04-01']
+
+
+def _crews(rows):
+    return job_crews(pd.DataFrame(rows, columns=['เลข Job', 'ชื่อ-นามสกุล']))
+
+
+def test_registry_counts_drivers_of_other_exports(tmp_path):
+    registry = str(tmp_path / 'registry.sqlite')
+    export_a = _crews([['J1', 'นาย ก'], ['J2', 'นาย ก'], ['J2', 'นาย ข']])
+    assert registry_job_counts({'J1': 1, 'J2': 2}, export_a, registry) == {'J1': 1, 'J2': 2}
+
+    # J1's other driver is in the second export
+    export_b = _crews([['J1', 'นาย ข'], ['J3', 'นาย ค']])
+    assert registry_job_counts({'J1': 1, 'J3': 1}, export_b, registry) == {'J1': 2, 'J3': 1}
+
+    # A third registered driver of J2 still counts as two
+    export_c = _crews([['J2', 'นาย ง']])
+    assert registry_job_counts({'J2': 1}, export_c, registry) == {'J2': 2}
+
+    # Re-registering an export, names spelled differently, adds nothing
+    export_b_again = _crews([['J1', ' นาย  ข '], ['J3', 'นาย\u00a0ค']])
+    assert registry_job_counts({'J1': 1, 'J3': 1}, export_b_again, registry) == {'J1': 2, 'J3': 1}
+    with TripStore(registry) as store:
+        assert store.crew_sizes(['J1', 'J2', 'J3']).to_dict() == {'J1': 2, 'J2': 3, 'J3': 1}
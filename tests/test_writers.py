@@ -0,0 +1,30 @@
+import pandas as pd
+import pytest
+
+from vis_writers import ParquetWriter
+
+pytest.importorskip('pyarrow')
+
+COLUMNS = ['ชื่อ-นามสกุล', 'ต้นทาง', 'กิโลเมตร', 'เบี้ยคำนวณ x ราคาน้ำมัน']
+
+
+def test_parquet_schema_does_not_depend_on_the_first_table(tmp_path):
+    path = str(tmp_path / 'out.parquet')
+    with ParquetWriter(path, COLUMNS) as writer:
+        # No ต้นทาง and no fuel bonus in the first table
+        writer.write_table(pd.DataFrame({'ชื่อ-นามสกุล': ['นาย ก'], 'กิโลเมตร': [400.0]}))
+        writer.write_table(pd.DataFrame({'ชื่อ-นามสกุล': ['นาย ข'], 'ต้นทาง': ['ระยอง'],
+                                         'กิโลเมตร': ['900'],
+                                         'เบี้ยคำนวณ x ราคาน้ำมัน': [12.5]}))
+    df = pd.read_parquet(path)
+    assert df['ต้นทาง'].tolist()[1] == 'ระยอง'
+    assert pd.isna(df['ต้นทาง'].tolist()[0])
+    assert df['กิโลเมตร'].tolist() == [400.0, 900.0]
+    assert df['ตาราง'].tolist() == [0, 1]
+
+
+def test_parquet_rejects_text_in_numeric_columns(tmp_path):
+    with ParquetWriter(str(tmp_path / 'out.parquet'), COLUMNS) as writer:
+        with pytest.raises(ValueError, match='กิโลเมตร'):
+            writer.write_table(pd.DataFrame({'ชื่อ-นามสกุล': ['นาย ก'],
+                                             'กิโลเมตร': ['ระยอง']}))
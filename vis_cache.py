@@ -0,0 +1,165 @@
+import hashlib
+import os
+import pickle
+import tempfile
+import time
+
+import pandas as pd
+
+from vis_metrics import record_stage
+from vis_parser import (PARSER_VERSION, iter_html_tables, iter_vis_tables,
+                        merge_job_counts)
+
+# Default on-disk parse cache location, override with VIS_CACHE_DIR
+DEFAULT_CACHE_DIR = os.environ.get('VIS_CACHE_DIR') or os.path.join(
+    os.path.expanduser('~'), '.cache', 'vis_html_format')
+
+# Evict the least recently used entries above this size
+DEFAULT_CACHE_MAX_BYTES = 1 << 30
+
+
+def file_digest(input_file):
+    """sha256 of a file's content"""
+    digest = hashlib.sha256()
+    with open(input_file, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _cache_path(cache_dir, digest):
+    return os.path.join(cache_dir, f"{digest}-p{PARSER_VERSION}.pkl")
+
+
+def parse_tables(input_file, html_parser=None):
+    """
+    Parse an export into (tables, job_counts) where tables is a list of
+    (table_index, headers, rows) and rows is a DataFrame of the raw cell text
+    (an empty list for tables without headers or data rows). html_parser
+    picks the HTML parser (see vis_parser.HTML_PARSERS).
+    """
+    return _collect_tables(iter_vis_tables(input_file, html_parser=html_parser))
+
+
+def parse_html(html):
+    """
+    parse_tables() for an in-memory export: HTML text (str), bytes (the
+    encoding is sniffed) or a file-like object. Nothing is read from or written to disk.
+    """
+    return _collect_tables(iter_html_tables(html))
+
+
+def _collect_tables(vis_tables):
+    tables = []
+    job_counts = {}
+    n_rows = 0
+    job_count_seconds = 0.0
+    started = time.perf_counter()
+    for table_index, headers, rows, table_job_counts in vis_tables:
+        counted = time.perf_counter()
+        merge_job_counts(job_counts, table_job_counts)
+        job_count_seconds += time.perf_counter() - counted
+        if headers and rows:
+            n_rows += len(rows)
+            rows = pd.DataFrame(rows, columns=headers)
+        tables.append((table_index, headers, rows))
+    record_stage('parse', time.perf_counter() - started - job_count_seconds, n_rows)
+    record_stage('job count', job_count_seconds, n_rows)
+    return tables, job_counts
+
+
+def read_tables(input_file, cache_dir=None, max_bytes=DEFAULT_CACHE_MAX_BYTES):
+    """
+    parse_tables() through the on-disk cache. Entries are keyed by the
+    file's sha256 and the parser version, so an unchanged export is never
+    parsed twice. cache_dir=None disables the cache.
+    Returns (tables, job_counts, from_cache).
+    """
+    if cache_dir is None:
+        return parse_tables(input_file) + (False,)
+
+    started = time.perf_counter()
+    cache_path = _cache_path(cache_dir, file_digest(input_file))
+    try:
+        with open(cache_path, 'rb') as file:
+            tables, job_counts = pickle.load(file)
+        # Mark the entry as recently used for eviction
+        os.utime(cache_path)
+        record_stage('read', time.perf_counter() - started,
+                     sum(len(rows) for _, _, rows in tables))
+        return tables, job_counts, True
+    except FileNotFoundError:
+        pass
+    except Exception:
+        # Unreadable entry, parse again and overwrite it
+        pass
+    record_stage('read', time.perf_counter() - started)
+
+    tables, job_counts = parse_tables(input_file)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            pickle.dump((tables, job_counts), file,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    evict(cache_dir, max_bytes)
+
+    return tables, job_counts, False
+
+
+def _cache_entries(cache_dir):
+    try:
+        names = os.listdir(cache_dir)
+    except FileNotFoundError:
+        return []
+    entries = []
+    for name in names:
+        if name.endswith('.pkl'):
+            path = os.path.join(cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+    return entries
+
+
+def evict(cache_dir, max_bytes=DEFAULT_CACHE_MAX_BYTES):
+    """Delete the least recently used entries until the cache fits in max_bytes"""
+    entries = sorted(_cache_entries(cache_dir))
+    total = sum(size for _, size, _ in entries)
+    removed = 0
+    for _, size, path in entries:
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        removed += 1
+    return removed
+
+
+def invalidate(cache_dir, input_file=None):
+    """
+    Remove the cache entry of one input file, or every entry when
+    input_file is None. Returns the number of entries removed.
+    """
+    if input_file is not None:
+        digest = file_digest(input_file)
+        paths = [path for _, _, path in _cache_entries(cache_dir)
+                 if os.path.basename(path).startswith(digest)]
+    else:
+        paths = [path for _, _, path in _cache_entries(cache_dir)]
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+    return len(paths)
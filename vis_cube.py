@@ -0,0 +1,199 @@
+"""
+Aggregation cube of processed trips: km, liters, fuel bonus, KM bonus and
+trip count per driver, car, car type, distance category and source. Each
+processed table (or chunk) is grouped once; cubes merge across tables,
+files and months with a groupby sum, are saved as a pickle, and the
+breakdown sheets (per car, car type, ...) are cut from the cube without
+the rows.
+
+    python vis_cube.py out/*_cube.pkl --by car,source -o year.xlsx
+"""
+import argparse
+import os
+import pickle
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+# Bump when the cube layout changes, older files are refused
+CUBE_VERSION = 2
+
+# Cube index levels: processed columns
+DIMENSIONS = ['ชื่อ-นามสกุล', 'เบอร์รถ', 'ประเภทรถ', 'ประเภทระยะทาง', 'ต้นทาง']
+
+# Summed measures (float64) and their processed columns; 'trips' counts
+# the rows
+MEASURE_COLUMNS = {
+    'km': 'กิโลเมตร',
+    'liters': 'น้ำมัน(ลิตร)',
+    'fuel_bonus': 'เบี้ยคำนวณ x ราคาน้ำมัน',
+    'km_bonus': 'โบนัสกิโลเมตร',
+}
+MEASURES = list(MEASURE_COLUMNS) + ['trips']
+
+# Breakdown name -> (dimension, sheet name)
+BREAKDOWNS = {
+    'driver': ('ชื่อ-นามสกุล', 'By_Driver'),
+    'car': ('เบอร์รถ', 'By_Car'),
+    'car_type': ('ประเภทรถ', 'By_Car_Type'),
+    'distance': ('ประเภทระยะทาง', 'By_Distance'),
+    'source': ('ต้นทาง', 'By_Source'),
+}
+
+# Breakdown sheet columns after the dimension, from the measures
+SHEET_COLUMNS = {
+    'trips': 'จำนวนเที่ยว',
+    'km': 'กิโลเมตร',
+    'liters': 'น้ำมัน(ลิตร)',
+    'fuel_bonus': 'เบี้ยประหยัดน้ำมัน',
+    'km_bonus': 'โบนัสกิโลเมตร',
+}
+
+
+def empty_cube():
+    index = pd.MultiIndex.from_arrays([[] for _ in DIMENSIONS], names=DIMENSIONS)
+    cube = pd.DataFrame({measure: pd.Series([], dtype=np.float64)
+                         for measure in MEASURE_COLUMNS}, index=index)
+    cube['trips'] = pd.Series([], index=index, dtype=np.int64)
+    return cube
+
+
+def _dimension_values(df, column):
+    """A dimension column as a Categorical, '' where missing"""
+    if column not in df.columns:
+        return pd.Categorical.from_codes(np.zeros(len(df), dtype=np.int8), [''])
+    values = df[column]
+    if not isinstance(values.dtype, pd.CategoricalDtype):
+        # Processed tables are compacted already (see vis_schema)
+        values = values.astype('category')
+    if values.hasnans:
+        if '' not in values.cat.categories:
+            values = values.cat.add_categories([''])
+        values = values.fillna('')
+    return values.array
+
+
+def build_cube(processed_df):
+    """Cube of one processed table or chunk (see process_driver_data)"""
+    if not len(processed_df):
+        return empty_cube()
+    frame = {column: _dimension_values(processed_df, column) for column in DIMENSIONS}
+    for measure, column in MEASURE_COLUMNS.items():
+        frame[measure] = (pd.to_numeric(processed_df[column], errors='coerce')
+                          .to_numpy(dtype=np.float64)
+                          if column in processed_df.columns
+                          else np.zeros(len(processed_df)))
+    frame['trips'] = np.ones(len(processed_df), dtype=np.int64)
+    return pd.DataFrame(frame).groupby(DIMENSIONS, sort=False, observed=True).sum()
+
+
+def merge_cubes(cubes):
+    """Merge cubes of tables, chunks, files or months into one"""
+    cubes = [cube for cube in cubes if cube is not None and len(cube)]
+    if not cubes:
+        return empty_cube()
+    if len(cubes) == 1:
+        return cubes[0]
+    return pd.concat(cubes).groupby(level=DIMENSIONS, sort=False, observed=True).sum()
+
+
+def breakdown_frame(cube, dimension):
+    """
+    One breakdown sheet: the cube summed over every other dimension, one
+    row per value of `dimension` (sorted), then a 'รวมทั้งหมด' total row
+    """
+    # Plain values, category levels would sort by category order
+    values = np.asarray(cube.index.get_level_values(dimension), dtype=object)
+    totals = cube.groupby(values).sum().sort_index()
+    totals.index.name = dimension
+    sheet = totals.reset_index()
+    sheet.loc[len(sheet)] = ['รวมทั้งหมด'] + totals.sum().tolist()
+    sheet = sheet.rename(columns=SHEET_COLUMNS)[[dimension] + list(SHEET_COLUMNS.values())]
+    sheet['จำนวนเที่ยว'] = sheet['จำนวนเที่ยว'].astype(np.int64)
+    sheet['รวมโบนัสทั้งหมด'] = sheet['เบี้ยประหยัดน้ำมัน'] + sheet['โบนัสกิโลเมตร']
+    return sheet
+
+
+def breakdown_sheets(cube, breakdowns):
+    """[(sheet name, frame)] for the given BREAKDOWNS names"""
+    return [(BREAKDOWNS[name][1], breakdown_frame(cube, BREAKDOWNS[name][0]))
+            for name in breakdowns]
+
+
+def parse_breakdowns(spec):
+    """'car,source' -> ['car', 'source']; 'all' is every breakdown"""
+    if spec.strip() == 'all':
+        return list(BREAKDOWNS)
+    names = [name.strip() for name in spec.split(',') if name.strip()]
+    unknown = [name for name in names if name not in BREAKDOWNS]
+    if unknown:
+        raise ValueError(f"Unknown breakdown: {', '.join(unknown)} "
+                         f"(choose from {', '.join(BREAKDOWNS)} or all)")
+    return names
+
+
+def save_cube(cube, path):
+    """Write a cube file, atomically"""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            pickle.dump((CUBE_VERSION, cube), file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def load_cube(path):
+    """Read a cube file written by save_cube"""
+    with open(path, 'rb') as file:
+        version, cube = pickle.load(file)
+    if version != CUBE_VERSION:
+        raise ValueError(f"{path}: cube version {version}, expected {CUBE_VERSION}")
+    return cube
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Merge cube files written by html_format.py --cube and "
+                    "cut breakdown sheets from them")
+    parser.add_argument('cubes', nargs='+', help="cube files (*_cube.pkl)")
+    parser.add_argument('--by', default='all', metavar='NAMES',
+                        help="comma-separated breakdowns: " + ', '.join(BREAKDOWNS)
+                             + " (default: all)")
+    parser.add_argument('-o', '--output', metavar='PATH',
+                        help="write the breakdown sheets to this xlsx workbook "
+                             "(default: print them)")
+    parser.add_argument('--save', metavar='PATH',
+                        help="also save the merged cube, to merge it again later")
+    args = parser.parse_args(argv)
+
+    try:
+        breakdowns = parse_breakdowns(args.by)
+        cube = merge_cubes(load_cube(path) for path in args.cubes)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    if args.save:
+        save_cube(cube, args.save)
+
+    sheets = breakdown_sheets(cube, breakdowns)
+    if args.output:
+        with pd.ExcelWriter(args.output) as workbook:
+            for sheet_name, sheet in sheets:
+                sheet.to_excel(workbook, sheet_name=sheet_name, index=False)
+    else:
+        with pd.option_context('display.max_rows', None, 'display.width', None):
+            for sheet_name, sheet in sheets:
+                print(sheet_name)
+                print(sheet.to_string(index=False))
+                print()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
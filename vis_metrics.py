@@ -0,0 +1,154 @@
+import json
+import logging
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Progress and warnings of the pipeline
+logger = logging.getLogger('vis')
+
+# Per-row debug output (bonus calculations, KM bonus hits); silent unless
+# enabled with enable_row_debug()
+row_logger = logging.getLogger('vis.rows')
+row_logger.setLevel(logging.WARNING)
+
+# Pipeline stages in report order
+STAGES = ['read', 'parse', 'job count', 'normalize', 'categorize', 'bonus',
+          'schema', 'scenarios', 'aggregate', 'write', 'store']
+
+# Metrics of the run in progress, see collect_metrics()
+_active_metrics = None
+
+
+def configure_logging(level=logging.INFO, row_debug=False):
+    """Log plain messages to stdout, as the script used to print them"""
+    root = logging.getLogger()
+    if not root.handlers:
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        root.addHandler(handler)
+    logger.setLevel(level)
+    enable_row_debug(row_debug)
+
+
+def enable_row_debug(enabled=True):
+    row_logger.setLevel(logging.DEBUG if enabled else logging.WARNING)
+
+
+def peak_rss_bytes():
+    """Peak resident set size of this process so far, None when unknown"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in KB elsewhere
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class RunMetrics:
+    """
+    Wall time, rows processed and peak RSS per pipeline stage. Stages may
+    be recorded from several threads (see vis_pipeline), and then overlap.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds, rows=0, **counters):
+        """Add a stage run; counters (e.g. bytes_saved) are summed per stage"""
+        rss = peak_rss_bytes()
+        with self._lock:
+            entry = self.stages.setdefault(
+                stage, {'seconds': 0.0, 'rows': 0, 'calls': 0, 'peak_rss_bytes': None})
+            entry['seconds'] += seconds
+            entry['rows'] += rows
+            entry['calls'] += 1
+            for name, value in counters.items():
+                entry[name] = entry.get(name, 0) + value
+            if rss is not None:
+                entry['peak_rss_bytes'] = max(entry['peak_rss_bytes'] or 0, rss)
+
+    def merge(self, stages):
+        """Add the stage metrics of another run (e.g. from a worker process)"""
+        for stage, other in stages.items():
+            entry = self.stages.setdefault(
+                stage, {'seconds': 0.0, 'rows': 0, 'calls': 0, 'peak_rss_bytes': None})
+            entry['seconds'] += other['seconds']
+            entry['rows'] += other['rows']
+            entry['calls'] += other['calls']
+            for name, value in other.items():
+                if name not in ('seconds', 'rows', 'calls', 'peak_rss_bytes'):
+                    entry[name] = entry.get(name, 0) + value
+            if other['peak_rss_bytes'] is not None:
+                entry['peak_rss_bytes'] = max(
+                    entry['peak_rss_bytes'] or 0, other['peak_rss_bytes'])
+
+    def as_dict(self):
+        order = {stage: i for i, stage in enumerate(STAGES)}
+        return dict(sorted(self.stages.items(),
+                           key=lambda item: order.get(item[0], len(order))))
+
+    def log_summary(self, level=logging.INFO):
+        for stage, entry in self.as_dict().items():
+            rss = entry['peak_rss_bytes']
+            saved = (f"  saved {entry['bytes_saved'] / 1e6:.1f} MB"
+                     if 'bytes_saved' in entry else "")
+            logger.log(level, "%-10s %8.3fs %9d rows  peak RSS %s%s", stage,
+                       entry['seconds'], entry['rows'],
+                       f"{rss / 1e6:.0f} MB" if rss is not None else "n/a", saved)
+
+
+@contextmanager
+def collect_metrics():
+    """Collect stage metrics recorded while the block runs"""
+    global _active_metrics
+    previous, _active_metrics = _active_metrics, RunMetrics()
+    try:
+        yield _active_metrics
+    finally:
+        _active_metrics = previous
+
+
+def record_stage(stage, seconds, rows=0, **counters):
+    """Record time spent in a stage, if metrics are being collected"""
+    if _active_metrics is not None:
+        _active_metrics.record(stage, seconds, rows, **counters)
+
+
+@contextmanager
+def stage(name, rows=0):
+    """Time the block as (part of) a pipeline stage"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - started, rows)
+
+
+def write_run_report(path, results, metrics, wall_seconds):
+    """Write a JSON run report: per-file results and per-stage metrics"""
+    report = {
+        'wall_seconds': wall_seconds,
+        'files': [{key: value for key, value in result.items() if key != 'log'}
+                  for result in results],
+        'stages': metrics.as_dict(),
+    }
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(report, file, ensure_ascii=False, indent=2, default=str)
+
+
+@contextmanager
+def quiet_logs(level=logging.WARNING):
+    """Only log messages of at least `level` while the block runs"""
+    previous = logger.level
+    logger.setLevel(max(level, logger.getEffectiveLevel()))
+    try:
+        yield
+    finally:
+        logger.setLevel(previous)
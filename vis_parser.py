@@ -0,0 +1,455 @@
+import codecs
+import datetime
+import io
+import itertools
+import os
+import re
+from html.parser import HTMLParser
+
+# Bump when the parser output changes, so cached parse results are rebuilt
+PARSER_VERSION = 3
+
+# Read the export in 1 MB pieces so the whole document is never held in memory
+CHUNK_SIZE = 1 << 20
+
+# Bytes looked at to tell the encoding of an HTML export
+SNIFF_BYTES = 64 << 10
+
+# Exports re-saved from Excel: OLE2 compound file (.xls) or zip (.xlsx)
+_OLE2_MAGIC = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'
+_ZIP_MAGIC = b'PK\x03\x04'
+
+_META_CHARSET = re.compile(rb'<meta[^>]*?charset\s*=\s*["\']?\s*([\w.:-]+)', re.I)
+
+# Thai charset names; cp874 is a superset of TIS-620
+_CHARSET_ALIASES = {'windows-874': 'cp874', 'x-windows-874': 'cp874',
+                    'tis-620': 'cp874', 'iso-8859-11': 'cp874'}
+
+# Exports that aren't utf-8 and don't declare a charset are Windows Thai
+FALLBACK_ENCODING = 'cp874'
+
+# Header spellings of the same column, by their whitespace-collapsed text
+HEADER_ALIASES = {
+    'ชื่อ พขร.': 'ชื่อ-นามสกุล',
+    'น้ำม มัน(ลิตร)': 'น้ำมัน(ลิตร)',
+}
+
+
+def canonical_header(text):
+    """Column name of a header cell: whitespace runs collapsed, aliases mapped"""
+    text = ' '.join(text.split())
+    return HEADER_ALIASES.get(text, text)
+
+
+def sniff_format(head):
+    """'xls', 'xlsx' or 'html' from the first bytes of an export file"""
+    if head.startswith(_OLE2_MAGIC):
+        return 'xls'
+    if head.startswith(_ZIP_MAGIC):
+        return 'xlsx'
+    return 'html'
+
+
+def sniff_encoding(head):
+    """
+    Encoding of an HTML export from its first bytes: a byte order mark,
+    else the <meta> charset, else utf-8 when the bytes decode as utf-8,
+    else FALLBACK_ENCODING.
+    """
+    for bom, encoding in ((codecs.BOM_UTF8, 'utf-8-sig'),
+                          (codecs.BOM_UTF16_LE, 'utf-16'),
+                          (codecs.BOM_UTF16_BE, 'utf-16')):
+        if head.startswith(bom):
+            return encoding
+    match = _META_CHARSET.search(head)
+    if match:
+        name = match.group(1).decode('ascii').lower()
+        try:
+            return codecs.lookup(_CHARSET_ALIASES.get(name, name)).name
+        except LookupError:
+            pass
+    try:
+        # Not final: the head may end inside a character
+        codecs.getincrementaldecoder('utf-8')().decode(head)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        return FALLBACK_ENCODING
+
+
+def merge_job_counts(job_counts, table_job_counts):
+    """
+    Merge one table's job counts into the running job counts.
+    A job that appears more than once (in any table) is counted as 2.
+    """
+    for job, count in table_job_counts.items():
+        job_counts[job] = min(job_counts.get(job, 0) + count, 2)
+    return job_counts
+
+
+class _TableCollector:
+    """
+    Turns rows into the (table_index, headers, rows, job_counts) tuples of
+    VISTableParser, whatever reads the rows (HTML parser or workbook).
+    """
+
+    def __init__(self, chunk_rows=None):
+        self.chunk_rows = chunk_rows
+        self.table_count = 0
+        self._finished = []
+        self._in_table = False
+        self._reset_table()
+
+    def _reset_table(self):
+        self._row_count = 0
+        self._headers = None
+        self._rows = []
+        self._job_counts = {}
+
+    def _start_table(self):
+        if self._in_table:
+            self._end_table()
+        self._in_table = True
+        self._reset_table()
+
+    def _add_row(self, row_text, th_cells, td_cells):
+        """One <tr>: all its text, and the texts of its <th> and <td> cells"""
+        self._row_count += 1
+
+        if self._row_count == 2:
+            self._headers = [canonical_header(text) for text in th_cells]
+            return
+        if self._row_count < 2:
+            return
+
+        # Skip summary rows
+        if 'รวม' in row_text:
+            return
+        cells = td_cells
+
+        # Job number is in the 3rd column
+        if len(cells) > 2 and cells[2]:
+            job_number = cells[2]
+            self._job_counts[job_number] = min(
+                self._job_counts.get(job_number, 0) + 1, 2)
+
+        if cells and self._headers:
+            if len(cells) < len(self._headers):
+                cells.extend([''] * (len(self._headers) - len(cells)))
+            elif len(cells) > len(self._headers):
+                cells = cells[:len(self._headers)]
+            self._rows.append(cells)
+            if self.chunk_rows and len(self._rows) >= self.chunk_rows:
+                self._finished.append(
+                    (self.table_count, self._headers, self._rows, self._job_counts))
+                self._rows = []
+                self._job_counts = {}
+
+    def _end_table(self):
+        self._finished.append(
+            (self.table_count, self._headers, self._rows, self._job_counts))
+        self.table_count += 1
+        self._in_table = False
+        self._reset_table()
+
+    def pop_tables(self):
+        """Return the tables finished since the last call"""
+        tables, self._finished = self._finished, []
+        return tables
+
+
+class VISTableParser(_TableCollector, HTMLParser):
+    """
+    Event-driven parser for VIS HTML exports.
+
+    Only the table currently being read is kept in memory. Finished tables
+    are queued as (table_index, headers, rows, job_counts) tuples and handed
+    out by pop_tables():
+      - headers is None when the table has fewer than 2 rows, and an empty
+        list when the second row has no <th> cells; header texts are
+        canonical column names (see canonical_header)
+      - rows are the <td> texts of every row after the two header rows,
+        skipping summary rows ('รวม'), padded/truncated to the header length
+      - job_counts maps the job number (3rd cell) to 1 or 2
+
+    With chunk_rows, a table's rows are also handed out every chunk_rows
+    rows: a long table then arrives as several tuples with the same
+    table_index, each with the rows and job counts of its own piece (the
+    last piece may have no rows).
+    """
+
+    def __init__(self, chunk_rows=None):
+        HTMLParser.__init__(self, convert_charrefs=True)
+        _TableCollector.__init__(self, chunk_rows)
+        self._in_row = False
+        self._cell = None
+
+    def _reset_table(self):
+        super()._reset_table()
+        self._row_text = []
+        self._row_th = []
+        self._row_td = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'table':
+            self._start_table()
+        elif not self._in_table:
+            return
+        elif tag == 'tr':
+            if self._in_row:
+                self._end_row()
+            self._in_row = True
+            self._row_text = []
+            self._row_th = []
+            self._row_td = []
+        elif tag in ('td', 'th') and self._in_row:
+            if self._cell is not None:
+                self._end_cell()
+            self._cell = (tag, [])
+
+    def handle_endtag(self, tag):
+        if not self._in_table:
+            return
+        if tag in ('td', 'th'):
+            if self._cell is not None and self._cell[0] == tag:
+                self._end_cell()
+        elif tag == 'tr':
+            if self._in_row:
+                self._end_row()
+        elif tag == 'table':
+            self._end_table()
+
+    def handle_data(self, data):
+        if not self._in_row:
+            return
+        self._row_text.append(data)
+        if self._cell is not None:
+            self._cell[1].append(data)
+
+    def _end_cell(self):
+        tag, parts = self._cell
+        text = ''.join(parts).strip()
+        if tag == 'td':
+            self._row_td.append(text)
+        else:
+            self._row_th.append(text)
+        self._cell = None
+
+    def _end_row(self):
+        if self._cell is not None:
+            self._end_cell()
+        self._in_row = False
+        self._add_row(''.join(self._row_text), self._row_th, self._row_td)
+
+    def _end_table(self):
+        if self._in_row:
+            self._end_row()
+        super()._end_table()
+
+    def close(self):
+        super().close()
+        if self._in_table:
+            self._end_table()
+
+
+class LxmlTableParser(_TableCollector):
+    """
+    VISTableParser on lxml's (libxml2) incremental HTML parser: same
+    feed()/close()/pop_tables() and the same tables, several times faster.
+    Rows are dropped from the tree once read.
+    """
+
+    def __init__(self, chunk_rows=None):
+        from lxml import etree
+        super().__init__(chunk_rows)
+        self._parser = etree.HTMLPullParser(
+            events=('start', 'end'), tag=('table', 'tr'))
+        # Text content of an element, as plain str (no reference to the tree)
+        self._text = etree.XPath('string()', smart_strings=False)
+        self._empty = True
+
+    def feed(self, data):
+        if data:
+            self._empty = False
+        self._parser.feed(data)
+        self._read_events()
+
+    def close(self):
+        # libxml2 fails on an empty document, html.parser finds no tables
+        if self._empty:
+            return
+        self._parser.close()
+        self._read_events()
+        if self._in_table:
+            self._end_table()
+
+    def _read_events(self):
+        for event, element in self._parser.read_events():
+            if element.tag == 'table':
+                if event == 'start':
+                    self._start_table()
+                elif self._in_table:
+                    self._end_table()
+                    element.clear()
+            elif event == 'end' and self._in_table:
+                th_cells = []
+                td_cells = []
+                for cell in element.iter('td', 'th'):
+                    # Cells are mostly plain text, skip the XPath call for those
+                    text = (cell.text or '') if not len(cell) else self._text(cell)
+                    (td_cells if cell.tag == 'td' else th_cells).append(text.strip())
+                self._add_row(self._text(element), th_cells, td_cells)
+                # Keep the tree small: the row and the rows before it are done
+                element.clear(keep_tail=True)
+                parent = element.getparent()
+                while element.getprevious() is not None:
+                    del parent[0]
+
+
+class WorkbookTableReader(_TableCollector):
+    """
+    The tables of a genuine workbook (an export re-saved from Excel), with
+    the same tuples as VISTableParser. Blank rows separate tables; the
+    first row of a table is its title and the second its header row.
+    """
+
+    def feed_rows(self, rows):
+        """Read the rows (lists of cell text) of one sheet"""
+        for cells in rows:
+            while cells and not cells[-1]:
+                cells.pop()
+            if not cells:
+                if self._in_table:
+                    self._end_table()
+                continue
+            if not self._in_table:
+                self._start_table()
+            self._add_row(''.join(cells), cells, cells)
+        if self._in_table:
+            self._end_table()
+
+
+def _cell_text(value):
+    """A workbook cell as the text the HTML export would show"""
+    if value is None or value != value:
+        return ''
+    if isinstance(value, datetime.datetime):
+        # Day first, like the VIS export
+        if value.time() == datetime.time():
+            return value.strftime('%d/%m/%Y')
+        return value.strftime('%d/%m/%Y %H:%M:%S')
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value).strip()
+
+
+def iter_workbook_tables(source, file_format='xlsx', chunk_rows=None):
+    """
+    Read an .xls (needs xlrd) or .xlsx (openpyxl) workbook - a path or a
+    binary file-like object - and yield (table_index, headers, rows,
+    job_counts) like iter_html_tables, for the tables of every sheet.
+    """
+    # Imported here, the HTML path doesn't need pandas
+    import pandas as pd
+
+    sheets = pd.read_excel(source, sheet_name=None, header=None, dtype=object,
+                           engine='xlrd' if file_format == 'xls' else 'openpyxl')
+    reader = WorkbookTableReader(chunk_rows)
+    for sheet in sheets.values():
+        reader.feed_rows([_cell_text(value) for value in values]
+                         for values in sheet.itertuples(index=False, name=None))
+        yield from reader.pop_tables()
+
+
+# Table parsers for HTML exports, by name
+HTML_PARSERS = {'lxml': LxmlTableParser, 'html.parser': VISTableParser}
+
+
+def default_html_parser():
+    """
+    $VIS_HTML_PARSER if set, else 'lxml' when lxml is installed (several
+    times faster), else the standard library's 'html.parser'
+    """
+    name = os.environ.get('VIS_HTML_PARSER')
+    if name:
+        return name
+    try:
+        import lxml.etree  # noqa: F401
+    except ImportError:
+        return 'html.parser'
+    return 'lxml'
+
+
+def _text_chunks(html, chunk_size, encoding=None):
+    """
+    Yield the text of an in-memory or file-like HTML document in pieces of
+    about chunk_size characters. Bytes are decoded incrementally from
+    memoryview slices, so the document is never copied as a whole, as
+    `encoding` or else the encoding sniffed from the first piece
+    (see sniff_encoding).
+    """
+    if isinstance(html, str):
+        for start in range(0, len(html), chunk_size):
+            yield html[start:start + chunk_size]
+        return
+
+    if isinstance(html, (bytes, bytearray, memoryview)):
+        view = memoryview(html).cast('B')
+        pieces = (view[start:start + chunk_size]
+                  for start in range(0, len(view), chunk_size))
+    else:
+        first = html.read(chunk_size)
+        if isinstance(first, str):
+            while first:
+                yield first
+                first = html.read(chunk_size)
+            return
+        pieces = itertools.chain([first], iter(lambda: html.read(chunk_size), b''))
+
+    decoder = None
+    for piece in pieces:
+        if decoder is None:
+            # Same newline handling as reading the file in text mode
+            decoder = io.IncrementalNewlineDecoder(codecs.getincrementaldecoder(
+                encoding or sniff_encoding(bytes(piece[:SNIFF_BYTES])))(),
+                translate=True)
+        yield decoder.decode(piece)
+    if decoder is not None:
+        yield decoder.decode(b'', final=True)
+
+
+def iter_html_tables(html, chunk_size=CHUNK_SIZE, chunk_rows=None,
+                     encoding=None, html_parser=None):
+    """
+    Stream an in-memory VIS export - HTML text (str), bytes or a
+    binary/text file-like object - and yield (table_index, headers, rows,
+    job_counts) for each <table> as soon as it has been read (or for every
+    chunk_rows rows of it, see VISTableParser). Bytes are decoded as
+    `encoding`, or as sniffed (see sniff_encoding). html_parser is a name
+    from HTML_PARSERS, by default default_html_parser().
+    """
+    parser = HTML_PARSERS[html_parser or default_html_parser()](chunk_rows)
+    for chunk in _text_chunks(html, chunk_size, encoding):
+        if chunk:
+            parser.feed(chunk)
+            yield from parser.pop_tables()
+    parser.close()
+    yield from parser.pop_tables()
+
+
+def iter_vis_tables(input_file, chunk_size=CHUNK_SIZE, chunk_rows=None,
+                    html_parser=None):
+    """
+    Stream a VIS export file and yield (table_index, headers, rows,
+    job_counts) for each <table> as soon as it has been read (or for every
+    chunk_rows rows of it, see VISTableParser). The file may be the HTML
+    export in any encoding (see sniff_encoding) or a workbook re-saved
+    from Excel (see iter_workbook_tables).
+    """
+    with open(input_file, 'rb') as file:
+        file_format = sniff_format(file.read(len(_OLE2_MAGIC)))
+        file.seek(0)
+        if file_format == 'html':
+            yield from iter_html_tables(file, chunk_size, chunk_rows,
+                                        html_parser=html_parser)
+        else:
+            yield from iter_workbook_tables(file, file_format, chunk_rows)
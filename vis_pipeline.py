@@ -0,0 +1,70 @@
+import queue
+import threading
+
+# Items a stage may run ahead of the next one
+PIPELINE_DEPTH = 2
+
+# Poll interval while waiting on a full queue, to notice a stopped consumer
+_POLL_SECONDS = 0.1
+
+_DONE = object()
+
+
+class _Failure:
+    def __init__(self, error):
+        self.error = error
+
+
+def pipelined(iterable, depth=PIPELINE_DEPTH, name=None):
+    """
+    Iterate `iterable` in a background thread, at most `depth` items ahead
+    of the consumer, and yield its items in order. Chaining calls gives a
+    staged pipeline with one thread per stage, connected by bounded
+    queues, e.g. pipelined(compute(pipelined(parse()))). An exception in the
+    stage is raised in the consumer; when the consumer stops early the
+    stage's generator is closed. depth=0 iterates in the calling thread.
+    """
+    if not depth:
+        yield from iterable
+        return
+
+    items = queue.Queue(depth)
+    stopped = threading.Event()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                items.put(item, timeout=_POLL_SECONDS)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        iterator = iter(iterable)
+        try:
+            for item in iterator:
+                if not put(item):
+                    break
+            else:
+                put(_DONE)
+        except BaseException as e:
+            put(_Failure(e))
+        finally:
+            close = getattr(iterator, 'close', None)
+            if close is not None:
+                close()
+
+    thread = threading.Thread(target=produce, name=name, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = items.get()
+            if item is _DONE:
+                return
+            if isinstance(item, _Failure):
+                raise item.error
+            yield item
+    finally:
+        stopped.set()
+        thread.join()
@@ -0,0 +1,105 @@
+import time
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_string_dtype, union_categoricals
+
+from vis_metrics import record_stage
+from vis_writers import TOTAL_COLUMNS
+
+# Columns that repeat a few values over many rows, always stored as category
+CATEGORY_COLUMNS = ['ชื่อ-นามสกุล', 'ชื่อ พขร.', 'เบอร์รถ', 'ประเภทรถ',
+                    'ประเภทระยะทาง', 'ต้นทาง']
+
+# Other text columns become category when at most this share of their
+# values is distinct (dates, destinations, ...)
+CATEGORY_MAX_UNIQUE_RATIO = 0.5
+
+# Summed into the total rows and the driver summary, keep 64-bit precision
+FULL_PRECISION_COLUMNS = set(TOTAL_COLUMNS)
+
+_INT32 = np.iinfo(np.int32)
+
+
+def _compact_series(name, series):
+    """A smaller-dtype copy of series, or series itself when nothing is gained"""
+    dtype = series.dtype
+    if is_string_dtype(dtype) and not isinstance(dtype, pd.CategoricalDtype):
+        if len(series) and (name in CATEGORY_COLUMNS or series.nunique(dropna=False)
+                            <= CATEGORY_MAX_UNIQUE_RATIO * len(series)):
+            return series.astype('category')
+    elif name in FULL_PRECISION_COLUMNS:
+        pass
+    elif dtype == np.float64:
+        values = series.to_numpy()
+        compact = values.astype(np.float32)
+        # Only when every value survives the round trip exactly
+        if np.array_equal(compact.astype(np.float64), values, equal_nan=True):
+            return pd.Series(compact, index=series.index, name=series.name)
+    elif dtype == np.int64:
+        values = series.to_numpy()
+        if not len(values) or (values.min() >= _INT32.min and values.max() <= _INT32.max):
+            return series.astype(np.int32)
+    return series
+
+
+def parse_vis_dates(values):
+    """
+    A column of trip dates as datetime64, NaT where unparseable. ISO dates
+    ('2025-04-16', from workbooks and other tools) are read as such, all
+    other values day first like VIS ('16/04/2025'). Each distinct value is
+    parsed once.
+    """
+    codes, uniques = pd.factorize(values)
+    text = pd.Series(uniques, dtype=object).astype(str).str.strip()
+    parsed = pd.to_datetime(text, format='ISO8601', errors='coerce')
+    other = parsed.isna().to_numpy()
+    if other.any():
+        parsed[other] = pd.to_datetime(text[other], format='mixed', dayfirst=True,
+                                       errors='coerce')
+    # Missing values (code -1) pick the NaT appended at the end
+    dates = np.append(parsed.to_numpy(dtype='datetime64[ns]'), np.datetime64('NaT', 'ns'))
+    return pd.Series(dates[codes], index=getattr(values, 'index', None))
+
+
+def compact_dtypes(df):
+    """
+    Convert low-cardinality text columns to category and numeric columns to
+    float32/int32 where no value changes. Converts df in place and returns
+    (df, bytes_saved); the saving is also recorded on the 'schema' stage.
+    """
+    started = time.perf_counter()
+    bytes_saved = 0
+    for position, name in enumerate(df.columns):
+        series = df.iloc[:, position]
+        compact = _compact_series(name, series)
+        if compact is not series:
+            bytes_saved += (series.memory_usage(index=False, deep=True)
+                            - compact.memory_usage(index=False, deep=True))
+            df.isetitem(position, compact)
+    record_stage('schema', time.perf_counter() - started, len(df),
+                 bytes_saved=bytes_saved)
+    return df, bytes_saved
+
+
+def concat_compact(frames):
+    """
+    pd.concat for compacted tables. Category columns are given the union of
+    the tables' categories first, otherwise pandas falls back to object.
+    """
+    frames = list(frames)
+    categorical = {name for frame in frames
+                   for name, dtype in frame.dtypes.items()
+                   if isinstance(dtype, pd.CategoricalDtype)}
+    for name in categorical:
+        columns = [frame[name] for frame in frames if name in frame.columns]
+        if not all(is_string_dtype(column.dtype)
+                   or isinstance(column.dtype, pd.CategoricalDtype)
+                   for column in columns):
+            continue
+        dtype = pd.CategoricalDtype(union_categoricals(
+            [column.astype('category') for column in columns],
+            ignore_order=True).categories)
+        frames = [frame.astype({name: dtype}) if name in frame.columns else frame
+                  for frame in frames]
+    return pd.concat(frames, ignore_index=True)
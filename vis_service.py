@@ -0,0 +1,237 @@
+"""
+Local HTTP service for branch clerks: upload a VIS export and an oil price,
+get the processed workbook back. The interpreter, the compiled rate table,
+fleet registry and KM bonus tables stay loaded between requests, so only
+the first start pays for importing pandas.
+
+    python vis_service.py --port 8765
+
+Open http://127.0.0.1:8765/ for an upload form, or post the export directly:
+
+    curl --data-binary @vis_export.xls -o out.xlsx 'http://127.0.0.1:8765/process?oil_price=31.5'
+"""
+import argparse
+import email.parser
+import email.policy
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from vis_metrics import configure_logging
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+
+# Larger uploads are refused with 413
+MAX_UPLOAD_BYTES = 256 << 20
+
+XLSX_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+# Smallest export that goes through every stage, processed once at start-up
+# so the first real request doesn't pay for lazy imports and compilation
+_WARM_UP_EXPORT = (
+    '<table><tr><th colspan="8">รายงาน</th></tr>'
+    '<tr><th>ลำดับ</th><th>วันที่</th><th>เลข Job</th><th>เบอร์รถ</th>'
+    '<th>ชื่อ พขร.</th><th>ต้นทาง</th><th>กิโลเมตร</th><th>เรท</th></tr>'
+    '<tr><td>1</td><td>2025-01-01</td><td>J1</td><td>X1</td><td>นาย ก ข</td>'
+    '<td>BKK</td><td>400</td><td>4.5</td></tr></table>')
+
+_UPLOAD_FORM = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>VIS bonus</title></head><body>
+<h1>คำนวณเบี้ยประหยัดน้ำมัน</h1>
+<form method="post" action="/process" enctype="multipart/form-data">
+<p>ไฟล์ VIS: <input type="file" name="file" required></p>
+<p>ราคาน้ำมัน: <input type="number" name="oil_price" step="0.01" required></p>
+<p><button type="submit">ประมวลผล</button></p>
+</form></body></html>
+"""
+
+# html_format is imported on first use (pandas takes most of the start-up)
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+# Set once warm_up() has run
+_warm = threading.Event()
+
+# process_file swaps process-wide metrics and log levels, one run at a time
+_process_lock = threading.Lock()
+
+logger = logging.getLogger('vis.service')
+
+
+def pipeline():
+    """The html_format module, imported on first use"""
+    global _pipeline
+    with _pipeline_lock:
+        if _pipeline is None:
+            import html_format
+            _pipeline = html_format
+    return _pipeline
+
+
+def warm_up():
+    """Import the pipeline, compile the data files and run a tiny export through it"""
+    started = time.perf_counter()
+    hf = pipeline()
+    with _process_lock:
+        hf.load_rate_table()
+        hf.load_fleet_registry()
+        hf.km_bonus_rates()
+        hf.special_source_pattern(tuple(hf.zero_calculation_sources))
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            input_path = os.path.join(tmp_dir, 'warm_up.xls')
+            with open(input_path, 'w', encoding='utf-8') as file:
+                file.write(_WARM_UP_EXPORT)
+            hf.process_file(input_path, 30.0, os.path.join(tmp_dir, 'warm_up.xlsx'))
+    _warm.set()
+    logger.info("Warm in %.2fs", time.perf_counter() - started)
+
+
+def process_upload(content, oil_price, filename='upload.xls', cache_dir=None):
+    """
+    Process an uploaded export (bytes) and return (result, xlsx bytes or
+    None), result being process_file's status dict.
+    """
+    hf = pipeline()
+    stem = os.path.splitext(os.path.basename(filename))[0] or 'upload'
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        input_path = os.path.join(tmp_dir, f"{stem}.xls")
+        output_path = os.path.join(tmp_dir, f"{stem}_processed.xlsx")
+        with open(input_path, 'wb') as file:
+            file.write(content)
+        with _process_lock:
+            result = hf.process_file(input_path, oil_price, output_path,
+                                     cache_dir=cache_dir)
+        if result['status'] != 'ok':
+            return result, None
+        with open(output_path, 'rb') as file:
+            return result, file.read()
+
+
+def _multipart_fields(content_type, body):
+    """{name: (filename, bytes)} of a multipart/form-data body"""
+    message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode('latin-1') + body)
+    fields = {}
+    for part in message.iter_parts():
+        name = part.get_param('name', header='content-disposition')
+        if name:
+            fields[name] = (part.get_filename(), part.get_payload(decode=True) or b'')
+    return fields
+
+
+class VISRequestHandler(BaseHTTPRequestHandler):
+    server_version = 'VISService/1'
+
+    def do_GET(self):
+        path = urllib.parse.urlsplit(self.path).path
+        if path == '/':
+            self._send(200, _UPLOAD_FORM.encode('utf-8'), 'text/html; charset=utf-8')
+        elif path == '/health':
+            self._send_json(200, {'status': 'ok', 'warm': _warm.is_set()})
+        else:
+            self._send_json(404, {'status': 'error', 'error': 'not found'})
+
+    def do_POST(self):
+        url = urllib.parse.urlsplit(self.path)
+        if url.path != '/process':
+            self._send_json(404, {'status': 'error', 'error': 'not found'})
+            return
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_UPLOAD_BYTES:
+            self._send_json(413, {'status': 'error', 'error': 'upload too large'})
+            return
+        body = self.rfile.read(length)
+
+        query = urllib.parse.parse_qs(url.query)
+        oil_price = (query.get('oil_price') or [None])[0]
+        filename = (query.get('filename') or ['upload.xls'])[0]
+        content_type = self.headers.get('Content-Type', '')
+        if content_type.startswith('multipart/form-data'):
+            fields = _multipart_fields(content_type, body)
+            filename, body = fields.get('file', (None, b''))
+            filename = filename or 'upload.xls'
+            if 'oil_price' in fields:
+                oil_price = fields['oil_price'][1].decode('utf-8').strip()
+        try:
+            oil_price = float(oil_price)
+        except (TypeError, ValueError):
+            self._send_json(400, {'status': 'error', 'error': 'oil_price is required'})
+            return
+        if not body:
+            self._send_json(400, {'status': 'error', 'error': 'no file uploaded'})
+            return
+
+        result, workbook = process_upload(body, oil_price, filename,
+                                          self.server.cache_dir)
+        logger.info("%s %s %d rows in %.2fs", filename, result['status'],
+                    result['rows'], result['seconds'])
+        if workbook is None:
+            self._send_json(422 if result['status'] == 'no tables' else 500,
+                            {'status': result['status'], 'error': result['error']})
+            return
+        download = f"{os.path.splitext(os.path.basename(filename))[0]}_processed.xlsx"
+        self._send(200, workbook, XLSX_TYPE, {
+            'Content-Disposition': "attachment; filename*=UTF-8''"
+                                   + urllib.parse.quote(download)})
+
+    def _send(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status, payload):
+        self._send(status, json.dumps(payload, ensure_ascii=False).encode('utf-8'),
+                   'application/json; charset=utf-8')
+
+    def log_message(self, format, *args):
+        logger.debug("%s %s", self.address_string(), format % args)
+
+
+def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, cache_dir=None, warm=True):
+    """Serve until interrupted; warming up runs in the background"""
+    server = ThreadingHTTPServer((host, port), VISRequestHandler)
+    server.cache_dir = cache_dir
+    if warm:
+        threading.Thread(target=warm_up, name='vis-warm-up', daemon=True).start()
+    logger.info("Serving on http://%s:%d/", *server.server_address[:2])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Serve the VIS bonus calculation over local HTTP")
+    parser.add_argument('--host', default=DEFAULT_HOST,
+                        help="address to listen on (default: %(default)s)")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT,
+                        help="port to listen on (default: %(default)s)")
+    parser.add_argument('--cache-dir',
+                        help="parse cache directory (default: no parse cache)")
+    parser.add_argument('--no-warm-up', action='store_true',
+                        help="import and compile on the first request instead of at start")
+    args = parser.parse_args(argv)
+
+    # Pipeline warnings only, plus one line per request
+    configure_logging(logging.WARNING)
+    logger.setLevel(logging.INFO)
+    serve(args.host, args.port, args.cache_dir, warm=not args.no_warm_up)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
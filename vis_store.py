@@ -0,0 +1,317 @@
+import argparse
+import os
+import sqlite3
+import sys
+import time
+
+import pandas as pd
+
+from vis_metrics import record_stage
+from vis_schema import parse_vis_dates
+
+# Default trip store location, override with VIS_STORE_PATH
+DEFAULT_STORE_PATH = os.environ.get('VIS_STORE_PATH') or os.path.join(
+    os.path.expanduser('~'), '.local', 'share', 'vis_html_format', 'trips.sqlite')
+
+# Version of the trips table, kept in PRAGMA user_version
+STORE_VERSION = 2
+
+# Store column -> processed column (see process_driver_data)
+TRIP_COLUMNS = {
+    'trip_date': 'วันที่',
+    'car_number': 'เบอร์รถ',
+    'car_type': 'ประเภทรถ',
+    'source': 'ต้นทาง',
+    'destination': 'ปลายทาง',
+    'km': 'กิโลเมตร',
+    'liters': 'น้ำมัน(ลิตร)',
+    'rate': 'เรท',
+    'distance_category': 'ประเภทระยะทาง',
+    'drivers_on_job': 'จำนวน พขร.',
+    'bonus_liters': 'เบี้ยคำนวณ',
+    'fuel_bonus': 'เบี้ยคำนวณ x ราคาน้ำมัน',
+    'km_bonus': 'โบนัสกิโลเมตร',
+    'total_bonus': 'รวมโบนัสทั้งหมด',
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS trips (
+    job TEXT NOT NULL,
+    driver TEXT NOT NULL,
+    leg INTEGER NOT NULL,
+    period TEXT,
+    trip_date TEXT,
+    car_number TEXT,
+    car_type TEXT,
+    source TEXT,
+    destination TEXT,
+    km REAL,
+    liters REAL,
+    rate REAL,
+    distance_category TEXT,
+    drivers_on_job INTEGER,
+    bonus_liters REAL,
+    oil_price REAL,
+    fuel_bonus REAL,
+    km_bonus REAL,
+    total_bonus REAL,
+    source_file TEXT,
+    table_index INTEGER,
+    imported_at REAL,
+    PRIMARY KEY (job, driver, leg)
+);
+CREATE INDEX IF NOT EXISTS trips_driver_period
+    ON trips (driver, period, km, fuel_bonus, km_bonus);
+CREATE INDEX IF NOT EXISTS trips_car_period
+    ON trips (car_number, period, km, liters, bonus_liters);
+CREATE INDEX IF NOT EXISTS trips_period ON trips (period);
+CREATE TABLE IF NOT EXISTS job_crews (
+    job TEXT NOT NULL,
+    driver TEXT NOT NULL,
+    PRIMARY KEY (job, driver)
+) WITHOUT ROWID;
+"""
+
+_INSERT_COLUMNS = (['job', 'driver', 'leg', 'period'] + list(TRIP_COLUMNS)
+                   + ['oil_price', 'source_file', 'table_index', 'imported_at'])
+
+_UPSERT = (
+    f"INSERT INTO trips ({', '.join(_INSERT_COLUMNS)}) "
+    f"VALUES ({', '.join('?' * len(_INSERT_COLUMNS))}) "
+    "ON CONFLICT (job, driver, leg) DO UPDATE SET "
+    + ', '.join(f"{column} = excluded.{column}" for column in _INSERT_COLUMNS[3:]))
+
+
+def trip_periods(trip_dates):
+    """
+    (period 'YYYY-MM', ISO date) lists for a column of VIS trip dates
+    ('2025-04-01', '16/04/2025', ...); unparseable dates give None.
+    """
+    # Trip dates repeat a lot, so parse and format each distinct value once
+    codes, unique_dates = pd.factorize(trip_dates)
+    parsed = parse_vis_dates(pd.Series(unique_dates, dtype=object))
+    valid = parsed.notna().tolist()
+
+    def lookup(formatted):
+        values = [value if ok else None for value, ok in zip(formatted.tolist(), valid)]
+        values.append(None)
+        return [values[code] for code in codes.tolist()]
+
+    return lookup(parsed.dt.strftime('%Y-%m')), lookup(parsed.dt.strftime('%Y-%m-%d'))
+
+
+def _column(df, name):
+    """A processed column as plain Python values, None when missing"""
+    if name not in df.columns:
+        return [None] * len(df)
+    series = df[name]
+    values = series.astype(object).tolist()
+    if series.hasnans:
+        values = [None if missing else value
+                  for value, missing in zip(values, series.isna().tolist())]
+    return values
+
+
+class TripStore:
+    """
+    SQLite store of processed trips, so year-to-date and per-truck figures
+    can be queried without re-processing old exports. Trips are keyed by
+    (เลข Job, driver, leg): leg numbers the rows of the same driver on the
+    same job within one export, so importing an export again updates its
+    trips instead of duplicating them. Added rows are visible to other
+    connections after commit().
+
+    The store also holds the job-crew registry: the normalized drivers seen
+    on every job number, over every export ingested, so a job whose two
+    drivers are in different exports still counts as a two-driver job.
+    """
+
+    def __init__(self, path=DEFAULT_STORE_PATH, timeout=60.0):
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.path = path
+        # Worker processes may write to the same store, wait for their locks
+        self.connection = sqlite3.connect(path, timeout=timeout)
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.executescript(_SCHEMA)
+        self.connection.execute(f"PRAGMA user_version = {STORE_VERSION}")
+        self.connection.commit()
+        self._source_file = None
+        self._legs = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        self.close()
+
+    def add_trips(self, processed_df, oil_price, source_file=None, table_index=None):
+        """
+        Upsert the rows of one processed table (or chunk of one) of
+        source_file, in export order. Rows without a driver are skipped.
+        Returns the number of rows stored.
+        """
+        started = time.perf_counter()
+        if source_file != self._source_file:
+            # Legs are numbered per export
+            self._source_file = source_file
+            self._legs = {}
+        if 'ชื่อ-นามสกุล' not in processed_df.columns:
+            return 0
+        names = processed_df['ชื่อ-นามสกุล']
+        df = processed_df[(names.notna() & (names != '')).to_numpy()]
+
+        jobs = (df['เลข Job'].astype(object).fillna('').astype(str)
+                if 'เลข Job' in df.columns else pd.Series('', index=df.index))
+        drivers = df['ชื่อ-นามสกุล'].astype(str)
+        # Number repeated (job, driver) rows, continuing across chunks
+        keys = pd.Series(list(zip(jobs, drivers)), index=df.index, dtype=object)
+        legs = (keys.groupby(keys, sort=False).cumcount()
+                + keys.map(lambda key: self._legs.get(key, 0)))
+        for key, count in keys.value_counts(sort=False).items():
+            self._legs[key] = self._legs.get(key, 0) + count
+
+        if 'วันที่' in df.columns:
+            periods, trip_dates = trip_periods(df['วันที่'])
+        else:
+            periods = trip_dates = [None] * len(df)
+        values = {column: _column(df, name) for column, name in TRIP_COLUMNS.items()}
+        values['trip_date'] = [iso or raw for iso, raw in zip(trip_dates, values['trip_date'])]
+        imported_at = time.time()
+
+        rows = zip(jobs.tolist(), drivers.tolist(), legs.tolist(), periods,
+                   *values.values(),
+                   *([value] * len(df) for value in
+                     (oil_price, source_file, table_index, imported_at)))
+        self.connection.executemany(_UPSERT, rows)
+        record_stage('store', time.perf_counter() - started, len(df))
+        return len(df)
+
+    def add_crews(self, job_crews):
+        """
+        Register (job, driver) pairs, e.g. from job_crews(); pairs already
+        known are ignored. Committed right away.
+        """
+        self.connection.executemany(
+            "INSERT OR IGNORE INTO job_crews (job, driver) VALUES (?, ?)",
+            zip(job_crews['job'].tolist(), job_crews['driver'].tolist()))
+        self.connection.commit()
+
+    def crew_sizes(self, jobs):
+        """
+        Number of registered drivers of each of the given jobs, as a Series
+        indexed by job number (jobs never registered are left out). One
+        primary key lookup per job, however large the registry grows.
+        """
+        self.connection.execute(
+            "CREATE TEMP TABLE IF NOT EXISTS wanted_jobs (job TEXT PRIMARY KEY)")
+        self.connection.execute("DELETE FROM wanted_jobs")
+        self.connection.executemany(
+            "INSERT OR IGNORE INTO wanted_jobs (job) VALUES (?)",
+            ((job,) for job in jobs))
+        sizes = self.connection.execute(
+            "SELECT job, COUNT(*) FROM wanted_jobs JOIN job_crews USING (job) "
+            "GROUP BY job").fetchall()
+        # Don't hold a read snapshot of the registry between calls
+        self.connection.commit()
+        return pd.Series(dict(sizes), dtype='int64')
+
+    def commit(self):
+        self.connection.commit()
+
+    def rollback(self):
+        self.connection.rollback()
+
+    def close(self):
+        self.connection.close()
+
+    def query(self, sql, params=()):
+        return pd.read_sql_query(sql, self.connection, params=params)
+
+    def driver_summary(self, driver=None, start=None, end=None, by_period=True):
+        """
+        Trips, km, fuel bonus and KM bonus per driver (and period 'YYYY-MM'
+        unless by_period is False) for periods start..end inclusive, e.g.
+        driver_summary(start='2025-01') for year-to-date figures. Answered
+        from the (driver, period) covering index.
+        """
+        where, params = _filter({'driver': driver}, start, end)
+        group = 'driver, period' if by_period else 'driver'
+        return self.query(
+            f"SELECT {group}, COUNT(*) AS trips, SUM(km) AS km, "
+            "SUM(fuel_bonus) AS fuel_bonus, SUM(km_bonus) AS km_bonus, "
+            "TOTAL(fuel_bonus) + TOTAL(km_bonus) AS total_bonus "
+            f"FROM trips INDEXED BY trips_driver_period {where} "
+            f"GROUP BY {group} ORDER BY {group}", params)
+
+    def car_summary(self, car_number=None, start=None, end=None, by_period=True):
+        """
+        Trips, km, fuel used, km per liter and bonus liters per car (and
+        period) for periods start..end inclusive, from the (car, period)
+        covering index.
+        """
+        where, params = _filter({'car_number': car_number}, start, end)
+        group = 'car_number, period' if by_period else 'car_number'
+        return self.query(
+            f"SELECT {group}, COUNT(*) AS trips, SUM(km) AS km, "
+            "SUM(liters) AS liters, SUM(km) / NULLIF(SUM(liters), 0) AS km_per_liter, "
+            "SUM(bonus_liters) AS bonus_liters "
+            f"FROM trips INDEXED BY trips_car_period {where} "
+            f"GROUP BY {group} ORDER BY {group}", params)
+
+    def trips(self, driver=None, car_number=None, job=None, start=None, end=None):
+        """The stored trips matching every given filter"""
+        where, params = _filter({'driver': driver, 'car_number': car_number, 'job': job},
+                                start, end)
+        return self.query(
+            f"SELECT * FROM trips {where} ORDER BY period, trip_date, job, driver, leg",
+            params)
+
+
+def _filter(equals, start, end):
+    """WHERE clause and parameters for column = value filters and a period range"""
+    conditions, params = [], []
+    for column, value in equals.items():
+        if value is not None:
+            conditions.append(f"{column} = ?")
+            params.append(value)
+    if start is not None:
+        conditions.append("period >= ?")
+        params.append(start)
+    if end is not None:
+        conditions.append("period <= ?")
+        params.append(end)
+    return (f"WHERE {' AND '.join(conditions)}" if conditions else ""), params
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Query the trip store filled by html_format.py --store")
+    parser.add_argument('store', nargs='?', default=DEFAULT_STORE_PATH,
+                        help="trip store file (default: %(default)s)")
+    parser.add_argument('--by', choices=['driver', 'car'], default='driver',
+                        help="summarize per driver or per car number")
+    parser.add_argument('--driver', help="only this driver (normalized name)")
+    parser.add_argument('--car', help="only this car number")
+    parser.add_argument('--start', metavar='YYYY-MM', help="first period")
+    parser.add_argument('--end', metavar='YYYY-MM', help="last period")
+    parser.add_argument('--total', action='store_true',
+                        help="one row per driver/car over all periods")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.store):
+        parser.error(f"trip store not found: {args.store}")
+    with TripStore(args.store) as store:
+        if args.by == 'car':
+            summary = store.car_summary(args.car, args.start, args.end, not args.total)
+        else:
+            summary = store.driver_summary(args.driver, args.start, args.end, not args.total)
+    with pd.option_context('display.max_rows', None, 'display.width', None):
+        print(summary.to_string(index=False))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
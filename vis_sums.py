@@ -0,0 +1,61 @@
+from fractions import Fraction
+
+import numpy as np
+
+# Every finite float64 is an integer multiple of 2**-1126 once its 53-bit
+# mantissa is taken as an integer, so sums are accumulated as Python ints in
+# units of 2**-1126 and rounded to float only when read
+_EXPONENT_BIAS = 1126
+_SCALE = 1 << _EXPONENT_BIAS
+
+# Mantissas are split in two halves so int64 group sums cannot overflow
+_LOW_BITS = 27
+
+
+def exact_sums(values, codes=None, n_groups=1):
+    """
+    Exact sums of finite float64 values per group (codes in range(n_groups),
+    all in group 0 when codes is None), as a list of Fractions. NaN values
+    are skipped like pandas' sum. Adding the results of any split of the
+    values gives the same sums, so totals do not depend on how rows were
+    chunked or grouped into tables. (Fractions rather than the underlying
+    ints, which pandas cannot keep in object columns.)
+    """
+    values = np.asarray(values, dtype=float)
+    codes = (np.zeros(len(values), dtype=np.int64) if codes is None
+             else np.asarray(codes, dtype=np.int64))
+    keep = ~np.isnan(values) & (codes >= 0)
+    values = values[keep]
+    codes = codes[keep]
+    sums = [0] * n_groups
+    if not len(values):
+        return [Fraction(0)] * n_groups
+
+    mantissas, exponents = np.frexp(values)
+    mantissas = (mantissas * (1 << 53)).astype(np.int64)
+    shifts = exponents.astype(np.int64) - 53 + _EXPONENT_BIAS
+    high = mantissas >> _LOW_BITS
+    low = mantissas - (high << _LOW_BITS)
+
+    # One int64 sum per (group, exponent), then exact Python int arithmetic
+    keys = codes * 4096 + shifts
+    order = np.argsort(keys, kind='stable')
+    keys = keys[order]
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    high_sums = np.add.reduceat(high[order], starts)
+    low_sums = np.add.reduceat(low[order], starts)
+    for key, high_sum, low_sum in zip(keys[starts].tolist(), high_sums.tolist(),
+                                      low_sums.tolist()):
+        group, shift = divmod(key, 4096)
+        sums[group] += ((high_sum << _LOW_BITS) + low_sum) << shift
+    return [Fraction(total, _SCALE) for total in sums]
+
+
+def exact_sum(values):
+    """Exact sum of float64 values as a Fraction, see exact_sums"""
+    return exact_sums(values)[0]
+
+
+def to_float(exact):
+    """Round an exact sum to the nearest float"""
+    return float(exact)
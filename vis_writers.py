@@ -0,0 +1,401 @@
+import csv
+import os
+
+import numpy as np
+import pandas as pd
+
+from vis_sums import exact_sum, to_float
+
+# Columns that get a total row per table and a grand total at the end
+TOTAL_COLUMNS = ['เบี้ยคำนวณ', 'เบี้ยคำนวณ x ราคาน้ำมัน',
+                 'โบนัสกิโลเมตร', 'รวมโบนัสทั้งหมด']
+
+# Numeric columns of processed tables (see process_driver_data); every
+# other column is text
+NUMERIC_COLUMNS = ['จำนวน พขร.', 'กิโลเมตร', 'น้ำมัน(ลิตร)', 'เรท', 'รวมกิโลเมตร',
+                   'โบนัสกิโลเมตร'] + TOTAL_COLUMNS
+
+OUTPUT_FORMATS = ('xlsx', 'csv', 'parquet')
+
+
+def _cell(value):
+    """Convert a DataFrame value to something the spreadsheet writers accept"""
+    if value is None:
+        return None
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    if isinstance(value, pd.Timestamp):
+        return value.to_pydatetime()
+    if value is pd.NA or value is pd.NaT:
+        return None
+    return value
+
+
+def _column_values(series):
+    """The values of one column as plain Python values, missing values as None"""
+    if pd.api.types.is_datetime64_any_dtype(series.dtype):
+        return [_cell(value) for value in series]
+    values = series.tolist()
+    if series.hasnans:
+        values = [None if missing else value
+                  for value, missing in zip(values, series.isna().tolist())]
+    return values
+
+
+def _rows(df):
+    """Iterate the rows of df as tuples of plain Python values, built column by column"""
+    return zip(*(_column_values(df.iloc[:, position])
+                 for position in range(df.shape[1])))
+
+
+class SheetLayout:
+    """
+    Layout of the All_Drivers sheet. Row 0 is the header; every table gets
+    its data rows and a 'รวม' total row, with an empty separator row before
+    every table but the first, and the 'รวมทั้งหมด' grand total comes last.
+    Rows are placed as they arrive - a table may come in several chunks -
+    so only row offsets and the running totals of TOTAL_COLUMNS are kept,
+    never the rows themselves. Totals are exact sums (see vis_sums), the
+    same however the rows were chunked.
+    """
+
+    def __init__(self, columns):
+        self.columns = list(columns)
+        self.total_columns = [col for col in TOTAL_COLUMNS if col in self.columns]
+        self._grand_totals = [0] * len(self.total_columns)
+        self._table_totals = None
+        self.tables = 0
+        self.rows = 0
+        self.next_row = 1
+
+    @property
+    def grand_totals(self):
+        return {col: to_float(total)
+                for col, total in zip(self.total_columns, self._grand_totals)}
+
+    def add_rows(self, df):
+        """
+        Place rows of the current table, starting a new table (after a
+        separator row) when none is open. Returns the first row's offset.
+        """
+        if self._table_totals is None:
+            if self.tables:
+                self.next_row += 1
+            self._table_totals = {}
+        for col in self.total_columns:
+            if col in df.columns:
+                self._table_totals[col] = (self._table_totals.get(col, 0)
+                                           + exact_sum(df[col].to_numpy(dtype=float)))
+        first_row = self.next_row
+        self.next_row += len(df)
+        self.rows += len(df)
+        return first_row
+
+    def end_table(self):
+        """
+        Close the current table and add it to the grand totals. Returns
+        (total_row, totals): total_row is None when the table has none of
+        TOTAL_COLUMNS.
+        """
+        table_totals = self._table_totals or {}
+        self._table_totals = None
+        totals = {}
+        for position, col in enumerate(self.total_columns):
+            if col in table_totals:
+                self._grand_totals[position] += table_totals[col]
+                totals[col] = to_float(table_totals[col])
+        total_row = None
+        if totals:
+            total_row = self.next_row
+            self.next_row += 1
+        self.tables += 1
+        return total_row, totals
+
+    def grand_total_row(self):
+        """Place the grand total row, None when there is nothing to total"""
+        if not self.tables or not self.total_columns:
+            return None
+        row = self.next_row
+        self.next_row += 1
+        return row
+
+    def label_row(self, label, totals):
+        """A total row: the label in the driver name column, totals below their columns"""
+        row = [None] * len(self.columns)
+        if 'ชื่อ-นามสกุล' in self.columns:
+            row[self.columns.index('ชื่อ-นามสกุล')] = label
+        for col, value in totals.items():
+            row[self.columns.index(col)] = _cell(value)
+        return row
+
+
+class _TableWriter:
+    """
+    Base class for output writers. Tables are written one at a time with
+    write_table(), or chunk by chunk with write_rows() and end_table(), and
+    forgotten; the SheetLayout keeps the running totals of TOTAL_COLUMNS
+    for the grand total row.
+    """
+
+    def __init__(self, output_path, columns):
+        self.output_path = output_path
+        self.layout = SheetLayout(columns)
+        self.columns = self.layout.columns
+
+    @property
+    def tables(self):
+        return self.layout.tables
+
+    @property
+    def rows(self):
+        return self.layout.rows
+
+    @property
+    def grand_totals(self):
+        return self.layout.grand_totals
+
+    def write_table(self, df):
+        self.write_rows(df)
+        self.end_table()
+
+    def write_rows(self, df):
+        raise NotImplementedError
+
+    def end_table(self):
+        self.layout.end_table()
+
+    def write_summary(self, summary_df):
+        self.write_sheet('Driver_Summary', summary_df)
+
+    def write_sheet(self, sheet_name, df):
+        """Write a small extra sheet (the summary, a breakdown) in one go"""
+        raise NotImplementedError
+
+    def close(self):
+        raise NotImplementedError
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class ExcelStreamWriter(_TableWriter):
+    """
+    Write the All_Drivers sheet row by row as tables finish, at the row
+    offsets of its SheetLayout (data, total and separator rows, then the
+    grand total row), then the Driver_Summary sheet and any other sheets.
+
+    Uses xlsxwriter in constant-memory mode when it is installed, otherwise
+    openpyxl's write-only mode.
+    """
+
+    def __init__(self, output_path, columns):
+        super().__init__(output_path, columns)
+        try:
+            import xlsxwriter
+        except ImportError:
+            xlsxwriter = None
+
+        if xlsxwriter is not None:
+            self._workbook = xlsxwriter.Workbook(
+                output_path, {'constant_memory': True})
+            self._bold = self._workbook.add_format({'bold': True})
+            self._sheet = self._workbook.add_worksheet('All_Drivers')
+            self._write_row = self._write_row_xlsxwriter
+        else:
+            from openpyxl import Workbook
+            self._workbook = Workbook(write_only=True)
+            self._sheet = self._workbook.create_sheet('All_Drivers')
+            self._write_row = self._write_row_openpyxl
+        self._next_rows = {}
+        self._grand_total_written = False
+        self._write_row(self._sheet, 0, self.columns, header=True)
+
+    def _write_row_xlsxwriter(self, sheet, row, values, header=False):
+        # Constant-memory mode only needs the rows in increasing order
+        sheet.write_row(row, 0, values, self._bold if header else None)
+
+    def _write_row_openpyxl(self, sheet, row, values, header=False):
+        # Write-only sheets are append-only, skipped rows are appended empty
+        next_row = self._next_rows.get(sheet.title, 0)
+        for _ in range(row - next_row):
+            sheet.append([])
+        sheet.append(values)
+        self._next_rows[sheet.title] = row + 1
+
+    def write_rows(self, df):
+        first_row = self.layout.add_rows(df)
+        for row, values in enumerate(_rows(df.reindex(columns=self.columns)),
+                                     start=first_row):
+            self._write_row(self._sheet, row, values)
+
+    def end_table(self):
+        total_row, totals = self.layout.end_table()
+        if total_row is not None:
+            self._write_row(self._sheet, total_row,
+                            self.layout.label_row('รวม', totals))
+
+    def write_sheet(self, sheet_name, df):
+        # All_Drivers is complete once another sheet is written
+        self._write_grand_total()
+        if hasattr(self._workbook, 'add_worksheet'):
+            sheet = self._workbook.add_worksheet(sheet_name)
+        else:
+            sheet = self._workbook.create_sheet(sheet_name)
+        self._write_row(sheet, 0, list(df.columns), header=True)
+        for row, values in enumerate(_rows(df), start=1):
+            self._write_row(sheet, row, values)
+
+    def _write_grand_total(self):
+        if not self._grand_total_written:
+            row = self.layout.grand_total_row()
+            if row is not None:
+                self._write_row(self._sheet, row, self.layout.label_row(
+                    'รวมทั้งหมด', self.grand_totals))
+        self._grand_total_written = True
+
+    def close(self):
+        if self._workbook is None:
+            return
+        self._write_grand_total()
+        if hasattr(self._workbook, 'add_worksheet'):
+            self._workbook.close()
+        else:
+            self._workbook.save(self.output_path)
+        self._workbook = None
+
+
+class CsvWriter(_TableWriter):
+    """
+    Columnar CSV output for payroll systems: one file with the data rows of
+    every table (plus a 'ตาราง' table index column, no total or separator
+    rows), <name>_summary.csv with the driver summary and <name>_<sheet>.csv
+    for other sheets (breakdowns).
+    """
+
+    def __init__(self, output_path, columns):
+        super().__init__(output_path, columns)
+        # utf-8-sig so Excel shows Thai text correctly
+        self._file = open(output_path, 'w', encoding='utf-8-sig', newline='')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(['ตาราง'] + self.columns)
+        self.summary_path = _summary_path(output_path)
+
+    def write_rows(self, df):
+        df = df.reindex(columns=self.columns)
+        df.insert(0, 'ตาราง', self.tables)
+        df.to_csv(self._file, header=False, index=False)
+        self.layout.add_rows(df)
+
+    def write_summary(self, summary_df):
+        summary_df.to_csv(self.summary_path, index=False,
+                          encoding='utf-8-sig')
+
+    def write_sheet(self, sheet_name, df):
+        df.to_csv(_sheet_path(self.output_path, sheet_name), index=False,
+                  encoding='utf-8-sig')
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class ParquetWriter(_TableWriter):
+    """
+    Columnar Parquet output: each table (or chunk) becomes a row group of one file
+    (plus a 'ตาราง' table index column), the driver summary goes to
+    <name>_summary.parquet and other sheets to <name>_<sheet>.parquet.
+    The schema is declared up front: NUMERIC_COLUMNS are float64, other
+    columns strings, whatever the first table holds. Requires pyarrow.
+    """
+
+    def __init__(self, output_path, columns):
+        super().__init__(output_path, columns)
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError(
+                "Parquet output requires pyarrow (pip install pyarrow)")
+        self._pa = pa
+        self._pq = pq
+        self._writer = None
+        self._arrow_schema = pa.schema(
+            [pa.field('ตาราง', pa.int32())]
+            + [pa.field(col, pa.float64() if col in NUMERIC_COLUMNS else pa.string())
+               for col in self.columns])
+        self.summary_path = _summary_path(output_path)
+
+    def _float_column(self, name, series):
+        """A NUMERIC_COLUMNS column as float64; text that is no number is an error"""
+        if not pd.api.types.is_numeric_dtype(series.dtype):
+            try:
+                series = pd.to_numeric(series)
+            except (ValueError, TypeError) as e:
+                raise ValueError(f"Column '{name}' of table {self.tables} "
+                                 f"is not numeric: {e}") from e
+        return series.astype(float)
+
+    def write_rows(self, df):
+        df = df.reindex(columns=self.columns)
+        df.insert(0, 'ตาราง', self.tables)
+        if self._writer is None:
+            self._writer = self._pq.ParquetWriter(
+                self.output_path, self._arrow_schema)
+        for field in self._arrow_schema:
+            if field.type == self._pa.string():
+                df[field.name] = df[field.name].astype('string')
+            elif field.type == self._pa.float64():
+                df[field.name] = self._float_column(field.name, df[field.name])
+        self._writer.write_table(self._pa.Table.from_pandas(
+            df, schema=self._arrow_schema, preserve_index=False))
+        self.layout.add_rows(df)
+
+    def write_summary(self, summary_df):
+        summary_df.to_parquet(self.summary_path, index=False)
+
+    def write_sheet(self, sheet_name, df):
+        df.to_parquet(_sheet_path(self.output_path, sheet_name), index=False)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+def _sheet_path(output_path, sheet_name):
+    """<name>_<sheet>.<ext> next to a columnar output file"""
+    stem, extension = os.path.splitext(output_path)
+    return f"{stem}_{sheet_name.lower()}{extension}"
+
+
+def _summary_path(output_path):
+    return _sheet_path(output_path, 'summary')
+
+
+def open_output_writer(output_path, columns, output_format='xlsx'):
+    """Open a streaming writer for the given output format"""
+    if output_format == 'xlsx':
+        return ExcelStreamWriter(output_path, columns)
+    if output_format == 'csv':
+        return CsvWriter(output_path, columns)
+    if output_format == 'parquet':
+        return ParquetWriter(output_path, columns)
+    raise ValueError(f"Unknown output format: {output_format}")
+
+
+def write_frame(df, output_path, sheet_name, output_format='xlsx'):
+    """Write a small frame (e.g. a scenario comparison) in one go"""
+    if output_format == 'xlsx':
+        df.to_excel(output_path, sheet_name=sheet_name, index=False)
+    elif output_format == 'csv':
+        df.to_csv(output_path, index=False, encoding='utf-8-sig')
+    elif output_format == 'parquet':
+        df.to_parquet(output_path, index=False)
+    else:
+        raise ValueError(f"Unknown output format: {output_format}")